@@ -1,6 +1,7 @@
 # Import the essential modules
 import rivalcfg, pystray, os, time, threading
-from PIL import Image, ImageDraw
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageDraw
 
 # Our state variables
 last_update = None
@@ -20,6 +21,11 @@ time_error = 60 * 0.2  # 60s * 0.2 = 12s
 directory = f"{os.path.dirname(os.path.realpath(__file__))}/"
 image_directory = f"{directory}images/"
 
+# Background for the transparency pass, black pixels are swapped for this
+transparent_background = Image.new("RGBA", (100, 100), (255, 255, 255, 0))
+# Lookup table turning a channel maximum into a mask: 0 for pure black, 255 otherwise
+visible_table = [0] + [255] * 255
+
 
 # Function to load the time delta from a file
 def load_time_delta():
@@ -80,9 +86,12 @@ def create_menu(name, battery_level, last_update, battery_charging):
     )
 
 
-# Function to load the images
+# Function to load the images, each one is decoded once and then kept in memory
+@lru_cache(maxsize=None)
 def load_image(image_name):
-    return Image.open(f"{image_directory}{image_name}.png")
+    image = Image.open(f"{image_directory}{image_name}.png")
+    image.load()
+    return image
 
 
 # Function to get the battery data
@@ -161,20 +170,11 @@ def create_battery_icon():
 
     image.paste(error, (0, 0), error)
 
+    # Make pure black pixels transparent using whole-image channel operations
     image = image.convert("RGBA")
-    data = image.getdata()
-    if data is None:
-        print("No data found in image, returning empty image.")
-        return image
-    new_data = []
-    for item in data:
-        if item[0] == 0 and item[1] == 0 and item[2] == 0:
-            new_data.append((255, 255, 255, 0))
-        else:
-            new_data.append(item)
-    image.putdata(new_data)
-
-    return image
+    r, g, b, _ = image.split()
+    visible = ImageChops.lighter(ImageChops.lighter(r, g), b).point(visible_table)
+    return Image.composite(image, transparent_background, visible)
 
 
 # Function to refresh the connection
@@ -0,0 +1,215 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from dataclasses import dataclass
+
+STEELSERIES_VID = 0x1038
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    drop_rate: float = 0.0
+    drop_timeout: float = 0.05
+    empty_rate: float = 0.0
+    disconnect_rate: float = 0.0
+
+class FakeHidDevice:
+    def __init__(self, backend):
+        self.backend = backend
+        self.dongle = None
+        self.pending = []
+        self.nonblocking = False
+
+    def _find(self, match):
+        for dongle in self.backend.dongles:
+            if match(dongle):
+                return dongle
+        raise IOError("open failed")
+
+    def open(self, vendor_id, product_id):
+        self.backend.sleep(self.backend.open_latency)
+        self.dongle = self._find(lambda d: d.vendor_id == vendor_id and d.model.product_id == product_id)
+        self.backend.opens += 1
+
+    def open_path(self, path):
+        self.backend.sleep(self.backend.open_latency)
+        self.dongle = self._find(lambda d: d.path == path)
+        self.backend.opens += 1
+
+    def set_nonblocking(self, enabled):
+        self.nonblocking = bool(enabled)
+        return 0
+
+    def write(self, data):
+        if self.dongle is None:
+            raise IOError("device not open")
+        faults = self.dongle.faults
+        self.backend.sleep(faults.latency)
+        if self.backend.rng.random() < faults.disconnect_rate:
+            self.dongle = None
+            raise IOError("device disconnected")
+        self.pending.append(self.dongle.response())
+        return len(data)
+
+    def read(self, max_length, timeout_ms=0):
+        if self.dongle is None:
+            raise IOError("device not open")
+        if self.nonblocking and not timeout_ms:
+            return self.pending.pop(0)[:max_length] if self.pending else []
+        faults = self.dongle.faults
+        self.backend.sleep(faults.latency)
+        roll = self.backend.rng.random()
+        if roll < faults.drop_rate:
+            if self.pending:
+                self.pending.pop(0)
+            self.backend.sleep(faults.drop_timeout)
+            return []
+        if roll < faults.drop_rate + faults.empty_rate or not self.pending:
+            return []
+        return self.pending.pop(0)[:max_length]
+
+    def close(self):
+        self.dongle = None
+        self.pending = []
+
+class FakeDongle:
+    def __init__(self, model, path, faults, battery_raw=None, charging=False):
+        self.model = model
+        self.charging = charging
+        self.vendor_id = model.vendor_id
+        self.path = path
+        self.faults = faults
+        lo, hi = model.battery_range
+        self.battery_raw = (lo + hi) // 2 if battery_raw is None else battery_raw
+
+    def response(self):
+        resp = [0] * self.model.read_buf_size
+        # Status byte as the Nova dongles send it: 0 headset off, 1 charging, 3 on battery
+        status = 0x01 if self.charging else 0x03
+        for idx in (self.model.connected_status_idx, self.model.charging_status_idx):
+            if idx is not None:
+                resp[idx] = status
+        resp[self.model.battery_percent_idx] = self.battery_raw
+        return resp
+
+    def descriptor(self):
+        interface = self.model.interface_number
+        return {
+            "vendor_id": self.vendor_id,
+            "product_id": self.model.product_id,
+            "path": self.path,
+            "interface_number": -1 if interface is None else interface,
+            "product_string": self.model.name,
+        }
+
+class FakeHid:
+    # Drop-in for the `hid` module, serving registry models as simulated dongles
+    def __init__(self, seed=0, enumerate_latency=0.0, open_latency=0.0):
+        self.rng = random.Random(seed)
+        self.enumerate_latency = enumerate_latency
+        self.open_latency = open_latency
+        self.dongles = []
+        self.mice = []
+        self.opens = 0
+        self.enumerates = 0
+
+    @staticmethod
+    def sleep(seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def add(self, model, faults=None, battery_raw=None, charging=False) -> FakeDongle:
+        path = f"/dev/hidraw-fake{len(self.dongles)}".encode()
+        dongle = FakeDongle(model, path, faults or Faults(), battery_raw, charging)
+        self.dongles.append(dongle)
+        return dongle
+
+    def remove(self, dongle):
+        self.dongles.remove(dongle)
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        self.sleep(self.enumerate_latency)
+        self.enumerates += 1
+        entries = [d.descriptor() for d in self.dongles] + list(self.mice)
+        return [
+            e for e in entries
+            if (not vendor_id or e["vendor_id"] == vendor_id) and (not product_id or e["product_id"] == product_id)
+        ]
+
+    def device(self):
+        return FakeHidDevice(self)
+
+class FakeMouse:
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    @property
+    def battery(self):
+        backend = self.backend
+        FakeHid.sleep(backend.faults.latency)
+        if not backend.present:
+            raise IOError("device disconnected")
+        if backend.rng.random() < backend.faults.empty_rate:
+            return {"level": None, "is_charging": None}
+        return {"level": backend.level, "is_charging": backend.charging}
+
+    def close(self):
+        pass
+
+class FakeRivalcfg:
+    # Drop-in for the `rivalcfg` module with a single simulated mouse
+    def __init__(self, name="SteelSeries Aerox 5 Wireless", level=80, charging=False, faults=None, seed=0, present=True,
+                 product_id=0x1852):
+        self.name = name
+        self.product_id = product_id
+        self.level = level
+        self.charging = charging
+        self.faults = faults or Faults()
+        self.rng = random.Random(seed)
+        self.present = present
+        self.lookups = 0
+        self.devices = SimpleNamespace(get_profile=self.get_profile)
+        self.mouse = SimpleNamespace(get_mouse=self.get_mouse)
+
+    def descriptor(self):
+        return {
+            "vendor_id": STEELSERIES_VID,
+            "product_id": self.product_id,
+            "path": b"/dev/hidraw-fake-mouse",
+            "interface_number": 0,
+            "product_string": self.name,
+        }
+
+    def get_profile(self, vendor_id, product_id):
+        if vendor_id != STEELSERIES_VID or product_id != self.product_id:
+            raise ValueError("unsupported device")
+        return {"name": self.name, "vendor_id": vendor_id, "product_id": product_id, "battery_level_query": 0x92}
+
+    def get_mouse(self, vendor_id=STEELSERIES_VID, product_id=None):
+        self.lookups += 1
+        FakeHid.sleep(self.faults.latency)
+        if not self.present or product_id != self.product_id or self.rng.random() < self.faults.disconnect_rate:
+            raise IOError("mouse not found")
+        return FakeMouse(self, self.name)
+
+    def get_first_mouse(self):
+        try:
+            return self.get_mouse(product_id=self.product_id)
+        except IOError:
+            return None
+
+def isolated_config() -> str:
+    # An empty config (all defaults) in a temp dir, so a developer's own config with hid_worker,
+    # hid_record_file or telemetry_url set cannot reach real hardware, logs or collectors
+    path = os.path.join(tempfile.mkdtemp(prefix="steeldevice-config-"), "config.json")
+    with open(path, "w") as f:
+        f.write("{}")
+    return path
+
+def install(fake_hid, fake_rivalcfg):
+    sys.modules["hid"] = fake_hid
+    sys.modules["rivalcfg"] = fake_rivalcfg
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import Program
+from aggregator import Aggregator
+
+def start_aggregator():
+    # The real aggregator on a free localhost port, in its own event loop thread
+    loop = asyncio.new_event_loop()
+    aggregator = Aggregator()
+    server = loop.run_until_complete(aggregator.serve("127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, name="aggregator", daemon=True).start()
+    return aggregator, loop, server.sockets[0].getsockname()[1]
+
+async def agent(port, name, devices, batches, rng, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for _ in range(batches):
+            records = [{
+                "device_id": f"headphone:1038:{d:04x}", "kind": "headphone", "name": "Arctis Nova 7",
+                "battery_level": rng.randint(0, 100), "is_charging": False, "is_connected": rng.random() > 0.05,
+                "is_degraded": False, "time_left": None, "timestamp": time.time(),
+            } for d in range(devices)]
+            body = zlib.compress(json.dumps({"agent": name, "records": records}).encode())
+            start = time.perf_counter()
+            writer.write((
+                f"POST /ingest HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                f"Content-Encoding: deflate\r\nContent-Length: {len(body)}\r\n\r\n"
+            ).encode() + body)
+            await writer.drain()
+            await read_response(reader)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        writer.close()
+
+async def read_response(reader):
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    return json.loads(await reader.readexactly(length))
+
+async def swarm(port, agents, devices, batches, seed):
+    latencies = []
+    await asyncio.gather(*(
+        agent(port, f"station-{i:04d}", devices, batches, random.Random(seed + i), latencies) for i in range(agents)
+    ))
+    return latencies
+
+def get(port, path):
+    return json.load(Program.urlrequest.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5))
+
+def exporter_roundtrip(port):
+    # An agent that starts while the collector is unreachable spools, then delivers everything once it is back
+    spool = tempfile.mkdtemp(prefix="steeldevice-spool-")
+    exporter = Program.TelemetryExporter("http://127.0.0.1:9/ingest", spool, "exporter-check", interval=0)
+    status = Program.DeviceStatus("Aerox 5 Wireless", 12, False, True)
+    exporter.on_status_changed({"mouse:1038:1852": (status, "1h 10m")})
+    exporter.flush()
+    spooled = len(exporter.spooled())
+    exporter.url = f"http://127.0.0.1:{port}/ingest"
+    exporter.on_status_changed({"mouse:1038:1852": (Program.replace(status, battery_level=11), "1h")})
+    exporter.flush()
+    delivered = [d for d in get(port, "/below?level=20") if d["agent"] == "exporter-check"]
+    return spooled, len(exporter.spooled()), delivered
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the telemetry aggregator with simulated agents on localhost")
+    parser.add_argument("--agents", type=int, default=500)
+    parser.add_argument("--devices", type=int, default=3, help="devices per agent")
+    parser.add_argument("--batches", type=int, default=10, help="batches each agent sends")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    aggregator, loop, port = start_aggregator()
+    start = time.perf_counter()
+    latencies = asyncio.run(swarm(port, args.agents, args.devices, args.batches, args.seed))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{args.agents} agents, {len(latencies)} batches, {aggregator.records} records in {elapsed:.2f} s "
+          f"({aggregator.records / elapsed:.0f} records/s), post median {latencies[len(latencies) // 2]:.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)]:.2f} ms")
+
+    start = time.perf_counter()
+    low = get(port, "/below?level=20")
+    print(f"below 20%: {len(low)} of {len(aggregator.index.devices)} devices, query {1000 * (time.perf_counter() - start):.2f} ms")
+
+    spooled, left, delivered = exporter_roundtrip(port)
+    print(f"exporter: {spooled} batch spooled while the collector was down, {left} left after it came back, "
+          f"delivered levels {[d['battery_level'] for d in delivered]}")
+    loop.call_soon_threadsafe(loop.stop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, "..", "src")]
+
+from fake_backends import FakeHid, FakeRivalcfg, install, isolated_config
+
+install(FakeHid(), FakeRivalcfg(present=False))
+import Program
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def start_monitor(fake_hid, event_source, rescan_interval):
+    Program.hid = fake_hid
+    Program.rivalcfg = FakeRivalcfg(present=False)
+    monitor = Program.BatteryMonitor(isolated_config())
+    monitor.config["autostart"] = False
+    monitor.history = None
+    monitor.discovery = Program.DeviceDiscovery(
+        event_source=event_source, rescan_interval=rescan_interval, on_change=monitor.on_hotplug)
+    monitor.timers.tolerance = 0.05
+    monitor.timers.start()
+    monitor.discovery.start()
+    threading.Thread(target=monitor.monitor_loop, daemon=True).start()
+    return monitor
+
+def check_events(model):
+    # Simulated add/remove events: each one wakes the monitor loop, which rescans and updates the device table
+    fake_hid = FakeHid()
+    events = Program.SimulatedEventSource()
+    monitor = start_monitor(fake_hid, events, rescan_interval=3600)
+    try:
+        if not wait_for(lambda: fake_hid.enumerates == 1):
+            return "no initial scan"
+        dongle = fake_hid.add(model)
+        events.emit("add", dongle.path)
+        if not wait_for(lambda: len(monitor.devices) == 1):
+            return "add event did not wake the monitor loop"
+        state = next(iter(monitor.devices.values()))
+        if not isinstance(state, Program.DeviceState) or not wait_for(lambda: state.status.battery_level is not None):
+            return "added device was not polled"
+        fake_hid.remove(dongle)
+        events.emit("remove", dongle.path)
+        if not wait_for(lambda: not monitor.devices):
+            return "remove event did not drop the device"
+        if state.session is not None:
+            return "removed device kept its HID session"
+    finally:
+        monitor.quit_app()
+
+def check_rescan(model):
+    # No event source (Windows, macOS) and an empty table: the periodic rescan alone must find a new dongle
+    fake_hid = FakeHid()
+    monitor = start_monitor(fake_hid, None, rescan_interval=0.3)
+    try:
+        if not wait_for(lambda: fake_hid.enumerates == 1):
+            return "no initial scan"
+        fake_hid.add(model)
+        if not wait_for(lambda: len(monitor.devices) == 1, timeout=3):
+            return f"rescan did not find the device ({fake_hid.enumerates} scans)"
+    finally:
+        monitor.quit_app()
+
+def main():
+    model = next(iter(Program.DeviceRegistry().models.values()))
+    failures = 0
+    for check in (check_events, check_rescan):
+        error = check(model)
+        print(f"{check.__name__:14} {'FAIL: ' + error if error else 'ok'}")
+        failures += error is not None
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
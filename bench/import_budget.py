@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, "..", "src")
+BUDGET_FILE = os.path.join(HERE, "import_budget.json")
+
+def measure():
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import Program"],
+        cwd=SRC, env=env, capture_output=True, text=True, check=True,
+    ).stderr
+    modules = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            modules[name.strip()] = int(cumulative)
+        except ValueError:
+            pass
+    return modules
+
+def main():
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)
+    measure()  # warm the bytecode cache
+    runs = [measure() for _ in range(budget.get("runs", 5))]
+    best_ms = min(run["Program"] for run in runs) / 1000
+    loaded = set().union(*runs)
+    forbidden = sorted(m for m in budget["forbidden_modules"] if m in loaded)
+    heaviest = sorted(runs[0].items(), key=lambda item: -item[1])[1:6]
+
+    print(f"import Program: {best_ms:.1f} ms (budget {budget['budget_ms']} ms)")
+    for name, cumulative in heaviest:
+        print(f"  {name:30} {cumulative / 1000:7.1f} ms")
+    if forbidden:
+        print(f"modules that must load lazily were imported: {', '.join(forbidden)}")
+    if best_ms > budget["budget_ms"] or forbidden:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
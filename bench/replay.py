@@ -0,0 +1,229 @@
+import argparse
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, "..", "src")]
+
+import Program
+from fake_backends import isolated_config
+from Program import HidRecorder
+
+Record = collections.namedtuple("Record", "timestamp duration type channel vendor_id product_id payload")
+
+class ReplayClock:
+    # Sleeps the recorded call durations, scaled down by speed; speed 0 replays without any waiting
+    def __init__(self, speed):
+        self.speed = speed
+
+    def pause(self, seconds):
+        if self.speed and seconds > 0:
+            time.sleep(seconds / self.speed)
+
+def load_cycles(path) -> list:
+    # Splits the log at CYCLE markers; every other record is filed under the device it belongs to
+    cycles = []
+    channels = {}
+    current = None
+    for fields in HidRecorder.read(path):
+        record = Record(*fields)
+        if record.type == HidRecorder.CYCLE:
+            current = {"timestamp": record.timestamp, "device_ids": json.loads(record.payload), "queues": {}, "enumerations": []}
+            cycles.append(current)
+            continue
+        if current is None:
+            continue
+        ids = (record.vendor_id, record.product_id)
+        if record.type == HidRecorder.ENUMERATE:
+            current["enumerations"].append(HidRecorder.decode_entries(record.payload))
+            continue
+        if record.type == HidRecorder.PROFILE:
+            key = ("profile",) + ids
+        elif record.type == HidRecorder.OPEN:
+            key = channels[record.channel] = ("hid",) + ids + (record.payload,)
+        elif record.type == HidRecorder.MOUSE_OPEN:
+            key = channels[record.channel] = ("mouse",) + ids
+        else:
+            key = channels.get(record.channel)
+            if key is None:
+                continue
+        current["queues"].setdefault(key, collections.deque()).append(record)
+    return cycles
+
+class ReplayBackend:
+    def __init__(self, clock):
+        self.clock = clock
+        self.queues = {}
+        self.mismatches = 0
+
+    def load(self, cycle):
+        self.queues = {key: collections.deque(queue) for key, queue in cycle["queues"].items()}
+
+    def take(self, key, rtype):
+        # Next record of rtype for this device; an ERROR on the way is raised like the original failure
+        queue = self.queues.get(key)
+        while queue:
+            record = queue.popleft()
+            if record.type == HidRecorder.ERROR:
+                self.clock.pause(record.duration)
+                raise IOError(record.payload.decode(errors="replace"))
+            if record.type != rtype:
+                self.mismatches += 1
+                continue
+            self.clock.pause(record.duration)
+            # Calls logged before they ran are followed by their ERROR when they failed
+            if queue and queue[0].type == HidRecorder.ERROR and rtype in (HidRecorder.OPEN, HidRecorder.WRITE, HidRecorder.MOUSE_OPEN):
+                error = queue.popleft()
+                self.clock.pause(error.duration)
+                raise IOError(error.payload.decode(errors="replace"))
+            return record
+        return None
+
+class ReplayHid(ReplayBackend):
+    # Drop-in for the hid module, answering from a recorded log one cycle at a time
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.entries = []
+
+    def load(self, cycle):
+        super().load(cycle)
+        if cycle["enumerations"]:
+            self.entries = cycle["enumerations"][0]
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        return [
+            dict(e) for e in self.entries
+            if (not vendor_id or e["vendor_id"] == vendor_id) and (not product_id or e["product_id"] == product_id)
+        ]
+
+    def device(self):
+        return ReplayDevice(self)
+
+class ReplayDevice:
+    def __init__(self, backend):
+        self.backend = backend
+        self.key = None
+
+    def open(self, vendor_id, product_id):
+        self._open(("hid", vendor_id, product_id, b""))
+
+    def open_path(self, path):
+        for entry in self.backend.entries:
+            if entry["path"] == path:
+                self._open(("hid", entry["vendor_id"], entry["product_id"], path))
+                return
+        raise IOError("open failed")
+
+    def _open(self, key):
+        if self.backend.take(key, HidRecorder.OPEN) is None:
+            raise IOError("open failed")
+        self.key = key
+
+    def set_nonblocking(self, enabled):
+        return 0
+
+    def write(self, data):
+        self.backend.take(self.key, HidRecorder.WRITE)
+        return len(data)
+
+    def read(self, max_length, timeout_ms=0):
+        record = self.backend.take(self.key, HidRecorder.READ)
+        return [] if record is None else list(record.payload[:max_length])
+
+    def close(self):
+        self.key = None
+
+class ReplayRivalcfg(ReplayBackend):
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.profiles = {}
+        self.devices = self
+        self.mouse = self
+
+    def load(self, cycle):
+        super().load(cycle)
+        for key, queue in cycle["queues"].items():
+            if key[0] == "profile":
+                self.profiles[key[1:]] = queue[-1].payload
+
+    def get_profile(self, vendor_id, product_id):
+        payload = self.profiles.get((vendor_id, product_id))
+        if not payload:
+            raise ValueError("unsupported device")
+        return json.loads(payload)
+
+    def get_mouse(self, vendor_id=Program.STEELSERIES_VID, product_id=None):
+        key = ("mouse", vendor_id, product_id)
+        if self.take(key, HidRecorder.MOUSE_OPEN) is None:
+            raise IOError("mouse not found")
+        return ReplayMouse(self, key)
+
+class ReplayMouse:
+    def __init__(self, backend, key):
+        self.backend = backend
+        self.key = key
+
+    @property
+    def battery(self):
+        record = self.backend.take(self.key, HidRecorder.MOUSE_BATTERY)
+        if record is None:
+            raise IOError("no recorded battery reading")
+        level, charging = record.payload
+        return {
+            "level": None if level == HidRecorder.NONE else level,
+            "is_charging": None if charging == HidRecorder.NONE else bool(charging),
+        }
+
+    def close(self):
+        pass
+
+def replay(path, speed, as_json, quiet):
+    cycles = load_cycles(path)
+    clock = ReplayClock(speed)
+    Program.hid = fake_hid = ReplayHid(clock)
+    Program.rivalcfg = fake_rivalcfg = ReplayRivalcfg(clock)
+    monitor = Program.BatteryMonitor(isolated_config())
+    monitor.config["autostart"] = False
+    monitor.discovery = Program.DeviceDiscovery(rescan_interval=float("inf"))
+    # The recorded cycles decide when to poll, not the monitor's own schedule
+    previous = None
+    start = time.perf_counter()
+    cycle_times = []
+    for cycle in cycles:
+        if previous is not None:
+            clock.pause(cycle["timestamp"] - previous)
+        previous = cycle["timestamp"]
+        fake_hid.load(cycle)
+        fake_rivalcfg.load(cycle)
+        if cycle["enumerations"]:
+            monitor.discovery.invalidate()
+        cycle_start = time.perf_counter()
+        monitor.poll_cycle(cycle["device_ids"])
+        cycle_times.append((time.perf_counter() - cycle_start) * 1000)
+        if not quiet:
+            Program.print_status(monitor.status_snapshot(), as_json)
+    elapsed = time.perf_counter() - start
+    monitor.quit_app()
+    if cycle_times:
+        cycle_times.sort()
+        print(f"{len(cycles)} cycles in {elapsed:.3f} s, cycle median {cycle_times[len(cycle_times) // 2]:.3f} ms, "
+              f"max {cycle_times[-1]:.3f} ms, {fake_hid.mismatches + fake_rivalcfg.mismatches} out-of-order records",
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a HID traffic log (Program.py --record) through BatteryMonitor")
+    parser.add_argument("log")
+    parser.add_argument("--speed", type=float, default=0, help="1 replays in real time, 100 a hundred times faster, 0 (default) without waiting")
+    parser.add_argument("--json", action="store_true", help="print every cycle's status as JSON")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+    log = os.path.abspath(args.log)
+    os.chdir(tempfile.mkdtemp(prefix="steeldevice-replay-"))
+    replay(log, args.speed, args.json, args.quiet)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE, os.path.join(HERE, "..", "src")]
+
+if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+    os.environ.setdefault("PYSTRAY_BACKEND", "dummy")
+
+from fake_backends import Faults, FakeHid, FakeRivalcfg, install, isolated_config
+
+install(FakeHid(), FakeRivalcfg())
+import Program
+
+SCENARIOS = {
+    "healthy": {"hid": Faults(), "mouse": Faults()},
+    "latency": {"hid": Faults(latency=0.005), "mouse": Faults(latency=0.02)},
+    "flaky": {
+        "hid": Faults(drop_rate=0.2, empty_rate=0.1, disconnect_rate=0.05),
+        "mouse": Faults(empty_rate=0.3, disconnect_rate=0.2),
+    },
+    "no_devices": None,
+}
+
+class TraySink:
+    # Receives what update_tray pushes, without an OS tray behind it
+    def __init__(self):
+        self.icon = None
+        self.menu = None
+        self.title = None
+
+def make_monitor(scenario, model, seed):
+    fake_hid = FakeHid(seed=seed)
+    fake_rivalcfg = FakeRivalcfg(seed=seed, present=scenario is not None)
+    if scenario is not None:
+        fake_hid.add(model, scenario["hid"])
+        fake_hid.mice.append(fake_rivalcfg.descriptor())
+        fake_rivalcfg.faults = scenario["mouse"]
+    Program.hid = fake_hid
+    Program.rivalcfg = fake_rivalcfg
+    monitor = Program.BatteryMonitor(isolated_config())
+    monitor.config["autostart"] = False
+    monitor.discovery = Program.DeviceDiscovery(rescan_interval=monitor.config["discovery_rescan_interval"])
+    monitor.tray_icon = TraySink()
+    return monitor
+
+def timed(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "n": repeat,
+        "min_ms": samples[0],
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max_ms": samples[-1],
+    }
+
+def run(repeat, models, scenarios, seed):
+    results = []
+
+    def record(name, scenario, model, stats):
+        results.append(dict(name=name, scenario=scenario, model=model, **stats))
+        print(f"{name:32} {scenario:11} {model:22} median {stats['median_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms")
+
+    for scenario_name in scenarios:
+        scenario = SCENARIOS[scenario_name]
+        for model in models:
+            monitor = make_monitor(scenario, model, seed)
+            record("find_steelseries_headphones", scenario_name, model.name,
+                   timed(monitor.find_steelseries_headphones, repeat, setup=monitor.discovery.invalidate))
+            record("find_steelseries_headphones_cached", scenario_name, model.name,
+                   timed(monitor.find_steelseries_headphones, repeat))
+            record("update_device_status", scenario_name, model.name, timed(monitor.update_device_status, repeat))
+            record("monitor_loop_cycle", scenario_name, model.name, timed(monitor.poll_cycle, repeat))
+            if scenario is None:
+                break
+
+    monitor = make_monitor(SCENARIOS["healthy"], models[0], seed)
+    monitor.update_device_status()
+    levels = iter(range(10 ** 9))
+
+    mouse = monitor.primary_device("mouse")
+
+    def vary():
+        mouse.status = Program.DeviceStatus(mouse.model.name, next(levels) % 101, False, True)
+
+    record("create_icon_uncached", "render", "-", timed(monitor.create_icon, repeat, setup=lambda: (vary(), monitor.icon_cache.items.clear())))
+    record("create_icon_cached", "render", "-", timed(monitor.create_icon, repeat))
+    record("create_menu_uncached", "render", "-", timed(monitor.create_menu, repeat, setup=lambda: (vary(), monitor.menu_cache.items.clear())))
+    record("create_menu_cached", "render", "-", timed(monitor.create_menu, repeat))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BatteryMonitor against simulated HID and rivalcfg backends")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", action="append", help="headphone model name (default: every model in the registry)")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    workdir = tempfile.mkdtemp(prefix="steeldevice-bench-")
+    os.chdir(workdir)
+    models = list(Program.DeviceRegistry().models.values())
+    if args.model:
+        models = [m for m in models if m.name in args.model]
+        if not models:
+            parser.error("no matching headphone model")
+    results = run(args.repeat, models, args.scenario or list(SCENARIOS), args.seed)
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
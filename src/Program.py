@@ -1,22 +1,103 @@
 import os
 import sys
+import signal
 import time
 import json
 import threading
-import winreg
-import hid
-import rivalcfg
-import pystray
-import tkinter as tk
-from tkinter import ttk, colorchooser, messagebox
-from PIL import Image, ImageDraw
-from dataclasses import dataclass
+import queue
+import importlib
+import struct
+import heapq
+import math
+import bisect
+import mmap
+import re
+import copy
+import zlib
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict, replace
 from typing import Optional, Tuple
 
-root = tk.Tk()
-root.withdraw()
+class LazyModule:
+    # Stands in for a module and imports it on first attribute access, so a status query or the
+    # headless poller never pays for the GUI stack and the hardware backends load only when polled
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+hid = LazyModule("hid")
+rivalcfg = LazyModule("rivalcfg")
+pystray = LazyModule("pystray")
+tk = LazyModule("tkinter")
+ttk = LazyModule("tkinter.ttk")
+colorchooser = LazyModule("tkinter.colorchooser")
+messagebox = LazyModule("tkinter.messagebox")
+Image = LazyModule("PIL.Image")
+ImageDraw = LazyModule("PIL.ImageDraw")
+socket = LazyModule("socket")
+tempfile = LazyModule("tempfile")
+argparse = LazyModule("argparse")
+urlrequest = LazyModule("urllib.request")
+multiprocessing = LazyModule("multiprocessing")
+tracemalloc = LazyModule("tracemalloc")
+cProfile = LazyModule("cProfile")
+pstats = LazyModule("pstats")
+ctypes = LazyModule("ctypes")
+
+try:
+    import winreg
+except ImportError:
+    winreg = None
+
+# Hidden Tk root, created on its own thread the first time a window is needed
+root = None
+root_lock = threading.Lock()
+
+def ensure_tk_root():
+    with root_lock:
+        if root is None:
+            ready = threading.Event()
+
+            def _run():
+                global root
+                root = tk.Tk()
+                root.withdraw()
+                ready.set()
+                root.mainloop()
+                # Tear Tcl down on the thread that created it
+                root.destroy()
+                root = None
+
+            threading.Thread(target=_run, name="tk", daemon=True).start()
+            ready.wait()
+    return root
 
 CONFIG_FILE = "battery_monitor_config.json"
+CONFIG_CHOICES = {"icon_style": ("split", "mouse_only", "headphone_only")}
+COLOR_RE = re.compile(r"#[0-9A-Fa-f]{6}")
+# Lower bounds for numbers where 0 would mean polling or rescanning as fast as possible, or timing out every read
+CONFIG_MINIMUMS = {
+    "update_interval": 10,
+    "min_poll_interval": 10,
+    "max_poll_interval": 10,
+    "discovery_rescan_interval": 10,
+    "poll_deadlines.mouse": 0.5,
+    "poll_deadlines.headphone": 0.5,
+    "hid_timeout_ms": 50,
+    "max_poll_workers": 1,
+    "menu_device_limit": 1,
+    "telemetry_interval": 1,
+    "timer_tolerance": 0.1,
+}
+# Folder next to the config file
+HISTORY_DIR = "battery_history"
 DEFAULT_CONFIG = {
     "update_interval": 300,
     "autostart": True,
@@ -29,25 +110,1265 @@ DEFAULT_CONFIG = {
         "error": "#808080"
     },
     "show_percentages": True,
-    "debug_mode": False
+    "debug_mode": False,
+    "poll_deadlines": {
+        "mouse": 5,
+        "headphone": 3
+    },
+    "discovery_rescan_interval": 900,
+    "adaptive_polling": True,
+    "min_poll_interval": 30,
+    "max_poll_interval": 3600,
+    "metrics_enabled": False,
+    "metrics_file": "",
+    "metrics_port": 0,
+    "history_enabled": True,
+    "ipc_socket": "",
+    "hid_timeout_ms": 1000,
+    "max_poll_workers": 32,
+    "menu_device_limit": 12,
+    "hid_record_file": "",
+    "hid_worker": False,
+    "telemetry_url": "",
+    "telemetry_interval": 60,
+    "telemetry_agent": "",
+    "telemetry_spool_dir": "",
+    "timer_tolerance": 5,
+    "profile_cycles": 0,
+    "profile_dir": ""
 }
 
+DEVICE_KINDS = ("mouse", "headphone")
+LOW_BATTERY = 20
+
 STEELSERIES_VID = 0x1038
-STEELSERIES_HEADPHONES = [
-    {"name": "Arctis Pro Wireless", "product_id": 0x1290, "write_bytes": [0x40, 0xaa], "battery_percent_idx": 0, "read_buf_size": 2, "battery_range": (0x00, 0x04)},
-    {"name": "Arctis 7 2017", "product_id": 0x1260, "write_bytes": [0x06, 0x18], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04)},
-    {"name": "Arctis 7 2019", "product_id": 0x12ad, "write_bytes": [0x06, 0x18], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04)},
-    {"name": "Arctis Pro 2019", "product_id": 0x1252, "write_bytes": [0x06, 0x18], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04)},
-    {"name": "Arctis Pro GameDAC", "product_id": 0x1280, "write_bytes": [0x06, 0x18], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04)},
-    {"name": "Arctis 9", "product_id": 0x12c2, "write_bytes": [0x00, 0x20], "battery_percent_idx": 3, "read_buf_size": 12, "battery_range": (0x64, 0xa5), "connected_status_idx": 4},
-    {"name": "Arctis 1 Wireless", "product_id": 0x12b3, "write_bytes": [0x06, 0x12], "battery_percent_idx": 3, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 4},
-    {"name": "Arctis 7X", "product_id": 0x12d7, "write_bytes": [0x06, 0x12], "battery_percent_idx": 3, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 4},
-    {"name": "Arctis 7 Plus", "product_id": 0x220e, "write_bytes": [0x00, 0xb0], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 3},
-    {"name": "Arctis Nova 7", "product_id": 0x2202, "write_bytes": [0x00, 0xb0], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 3},
-    {"name": "Arctis Nova 7X", "product_id": 0x2206, "write_bytes": [0x00, 0xb0], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 3},
-    {"name": "Arctis Nova 7P", "product_id": 0x220a, "write_bytes": [0x00, 0xb0], "battery_percent_idx": 2, "read_buf_size": 8, "battery_range": (0x00, 0x04), "connected_status_idx": 3},
-    {"name": "Arctis Nova 5", "product_id": 0x2232, "write_bytes": [0x00, 0xb0], "battery_percent_idx": 3, "read_buf_size": 64, "battery_range": (0x00, 0x64), "connected_status_idx": 4},
-]
+HEADPHONES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "headphones.json")
+
+@dataclass
+class HeadphoneModel:
+    name: str
+    product_id: int
+    write_bytes: list
+    battery_percent_idx: int
+    read_buf_size: int
+    battery_range: Tuple[int, int]
+    connected_status_idx: Optional[int] = None
+    interface_number: Optional[int] = None
+    vendor_id: int = STEELSERIES_VID
+    charging_status_idx: Optional[int] = None
+    charging_values: Tuple[int, ...] = (0x01,)
+
+    def __post_init__(self):
+        # Every possible raw byte is mapped to a percentage once, decoding is then a single index
+        lo, hi = self.battery_range
+        span = max(1, hi - lo)
+        self.battery_table = bytes(max(0, min(100, (raw - lo) * 100 // span)) for raw in range(256))
+        fields = (self.battery_percent_idx, self.connected_status_idx, self.charging_status_idx)
+        self.report_size = max(idx for idx in fields if idx is not None) + 1
+
+    @property
+    def key(self):
+        return self.vendor_id, self.product_id, self.interface_number
+
+    @property
+    def step(self) -> int:
+        # Smallest level change the headset can report, 25 for the 0-4 range models
+        span = self.battery_range[1] - self.battery_range[0]
+        return 100 // span if 0 < span < 100 else 1
+
+    def decode_battery(self, raw: int) -> int:
+        return self.battery_table[raw & 0xff]
+
+    def decode(self, report) -> Tuple[Optional[int], Optional[bool]]:
+        # report is bytes or a memoryview of one read; only the mapped bytes are looked at.
+        # (None, None) when the report is short or the headset is off.
+        if len(report) < self.report_size:
+            return None, None
+        if self.connected_status_idx is not None and report[self.connected_status_idx] == 0:
+            return None, None
+        charging = None
+        if self.charging_status_idx is not None:
+            charging = report[self.charging_status_idx] in self.charging_values
+        return self.battery_table[report[self.battery_percent_idx]], charging
+
+class DeviceRegistry:
+    def __init__(self, path=HEADPHONES_FILE):
+        self.path = path
+        self._models = None
+
+    @property
+    def models(self) -> dict:
+        if self._models is None:
+            self._models = self.load()
+        return self._models
+
+    def load(self) -> dict:
+        models = {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            default_vid = int(data.get("vendor_id", hex(STEELSERIES_VID)), 0)
+            for entry in data.get("headphones", []):
+                model = HeadphoneModel(
+                    name=entry["name"],
+                    product_id=int(entry["product_id"], 0),
+                    write_bytes=[int(b, 0) for b in entry["write_bytes"]],
+                    battery_percent_idx=entry["battery_percent_idx"],
+                    read_buf_size=entry["read_buf_size"],
+                    battery_range=tuple(int(b, 0) for b in entry["battery_range"]),
+                    connected_status_idx=entry.get("connected_status_idx"),
+                    interface_number=entry.get("interface_number"),
+                    vendor_id=int(entry.get("vendor_id", hex(default_vid)), 0),
+                    charging_status_idx=entry.get("charging_status_idx"),
+                    charging_values=tuple(int(v, 0) for v in entry.get("charging_values", ["0x01"])),
+                )
+                models[model.key] = model
+        except Exception as e:
+            print(f"Error loading device definitions: {e}")
+        return models
+
+    def lookup(self, vendor_id, product_id, interface_number=None) -> Optional[HeadphoneModel]:
+        models = self.models
+        return models.get((vendor_id, product_id, interface_number)) or models.get((vendor_id, product_id, None))
+
+
+class PhaseTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    # Latency histograms per cycle phase plus event counters, exported in Prometheus text format.
+    # While disabled, phase() hands out one shared no-op context and count() returns immediately.
+    BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    NULL_TIMER = nullcontext()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def phase(self, name):
+        if not self.enabled:
+            return self.NULL_TIMER
+        return PhaseTimer(self, name)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {"buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0}
+            idx = bisect.bisect_left(self.BUCKETS, seconds)
+            if idx < len(self.BUCKETS):
+                histogram["buckets"][idx] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def render(self) -> str:
+        lines = ["# TYPE steeldevice_phase_seconds histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for le, n in zip(self.BUCKETS, histogram["buckets"]):
+                    cumulative += n
+                    lines.append(f'steeldevice_phase_seconds_bucket{{phase="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'steeldevice_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'steeldevice_phase_seconds_sum{{phase="{name}"}} {histogram["sum"]:.6f}')
+                lines.append(f'steeldevice_phase_seconds_count{{phase="{name}"}} {histogram["count"]}')
+            lines.append("# TYPE steeldevice_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'steeldevice_events_total{{event="{name}"}} {value}')
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE steeldevice_{name} gauge")
+                lines.append(f"steeldevice_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+class MetricsServer:
+    # Serves /metrics on localhost only
+    def __init__(self, metrics, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._serve, name="metrics", daemon=True).start()
+
+    def _serve(self):
+        # Blocks in accept; serve_forever would wake every 0.5 s to look for a shutdown request
+        while self.running:
+            self.server.handle_request()
+
+    def stop(self):
+        self.running = False
+        # One throwaway connection gets the serving thread out of accept
+        try:
+            socket.create_connection(self.server.server_address, timeout=1).close()
+        except OSError:
+            pass
+        self.server.server_close()
+
+metrics = Metrics()
+
+def process_rss() -> Optional[int]:
+    # Resident set size in bytes, or None where it cannot be read without extra packages
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        # PROCESS_MEMORY_COUNTERS: cb, PageFaultCount, then SIZE_T fields starting with Peak/WorkingSetSize
+        counters = (ctypes.c_size_t * 10)()
+        counters[0] = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), counters, counters[0]):
+            return counters[2]
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    # macOS: only the peak is available, in bytes there
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def process_handles() -> Optional[int]:
+    # Open file descriptors, or handles on Windows
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        pass
+    if sys.platform == "win32":
+        count = ctypes.c_ulong()
+        if ctypes.windll.kernel32.GetProcessHandleCount(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(count)):
+            return count.value
+        return None
+    try:
+        return len(os.listdir("/dev/fd"))
+    except OSError:
+        return None
+
+class CycleProfiler:
+    # Opt-in diagnostics for a long-running agent: CPU time, RSS and open handles after every poll cycle,
+    # the allocation sites that grew most since the last snapshot every snapshot_every cycles, and
+    # cProfile stats for the next cycle when asked. Everything goes to stderr with a [PROFILE] prefix,
+    # stdout stays clean for --once --json.
+    def __init__(self, snapshot_every=60, output_dir="", top=10):
+        self.snapshot_every = snapshot_every
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.top = top
+        self.cycles = 0
+        self.snapshot = None
+        self.profile_next = False
+        self.task_profiles = None
+        self.lock = threading.Lock()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def request_profile(self):
+        self.profile_next = True
+
+    def wrap(self, task):
+        # Poll tasks run on PollPool threads. Before 3.12 a cProfile.Profile sees only the thread that
+        # enabled it, so during a profiled cycle every task gets its own, merged into the cycle's stats.
+        def run_task():
+            profiles = self.task_profiles
+            if profiles is None or sys.version_info >= (3, 12):
+                return task()
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(task)
+            finally:
+                with self.lock:
+                    profiles.append(profile)
+        return run_task
+
+    def run(self, cycle, *args, device_handles=None):
+        profile = None
+        if self.profile_next:
+            self.profile_next = False
+            profile = cProfile.Profile()
+            self.task_profiles = []
+        cpu = time.process_time()
+        try:
+            if profile is not None:
+                return profile.runcall(cycle, *args)
+            return cycle(*args)
+        finally:
+            cpu = time.process_time() - cpu
+            self.cycles += 1
+            self.report(cpu, device_handles() if device_handles else None)
+            if profile is not None:
+                with self.lock:
+                    profiles, self.task_profiles = self.task_profiles, None
+                self.dump(profile, profiles)
+            if self.cycles % self.snapshot_every == 0:
+                self.compare()
+
+    def report(self, cpu, device_handles):
+        rss = process_rss()
+        handles = process_handles()
+        metrics.observe("cycle_cpu", cpu)
+        for name, value in (("rss_bytes", rss), ("open_handles", handles), ("device_handles", device_handles)):
+            if value is not None:
+                metrics.gauge(name, value)
+        rss_text = "?" if rss is None else f"{rss / 1048576:.1f} MiB"
+        print(f"[PROFILE] cycle {self.cycles}: cpu {cpu * 1000:.1f} ms, rss {rss_text}, "
+              f"handles {'?' if handles is None else handles}, device handles {device_handles}", file=sys.stderr)
+
+    def compare(self):
+        # The profiler's own allocations would otherwise top the list
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, sys.modules[name].__file__)
+            for name in ("tracemalloc", "cProfile", "profile", "pstats") if name in sys.modules
+        ] + [tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")])
+        previous, self.snapshot = self.snapshot, snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"[PROFILE] traced {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB) after {self.cycles} cycles", file=sys.stderr)
+        if previous is None:
+            return
+        growth = [stat for stat in snapshot.compare_to(previous, "lineno") if stat.size_diff > 0][:self.top]
+        for stat in growth:
+            frame = stat.traceback[0]
+            print(f"[PROFILE]   +{stat.size_diff / 1024:.1f} KiB ({stat.count_diff:+d} blocks) {frame.filename}:{frame.lineno}", file=sys.stderr)
+
+    def dump(self, profile, task_profiles):
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        for task_profile in task_profiles:
+            stats.add(task_profile)
+        path = os.path.join(self.output_dir, f"steeldevice-cycle-{int(time.time())}.prof")
+        try:
+            stats.dump_stats(path)
+        except OSError as e:
+            print(f"Error writing profile: {e}", file=sys.stderr)
+            path = None
+        print(f"[PROFILE] cycle {self.cycles} profile{' written to ' + path if path else ''}:", file=sys.stderr)
+        stats.sort_stats("cumulative").print_stats(15)
+
+class HidTimeout(IOError):
+    pass
+
+class HidSession:
+    # Reports left over from an earlier query that timed out; more than this means the device is streaming
+    MAX_STALE_REPORTS = 16
+
+    def __init__(self, vendor_id, product_id, path=None):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.path = path
+        self.device = None
+
+    def open(self):
+        if self.device is None:
+            with metrics.phase("open"):
+                d = hid.device()
+                try:
+                    if self.path:
+                        d.open_path(self.path)
+                    else:
+                        d.open(self.vendor_id, self.product_id)
+                    d.set_nonblocking(1)
+                except Exception:
+                    # Not kept anywhere yet, so nobody else would close it
+                    try:
+                        d.close()
+                    except Exception:
+                        pass
+                    raise
+            self.device = d
+        return self.device
+
+    def close(self):
+        if self.device is not None:
+            try:
+                self.device.close()
+            except Exception:
+                pass
+            self.device = None
+
+    def drain(self, d, read_size):
+        # A late answer to the previous query would otherwise be taken as the answer to this one
+        for _ in range(self.MAX_STALE_REPORTS):
+            if not d.read(read_size):
+                return
+            metrics.count("hid_stale_reports")
+
+    def query(self, write_bytes, read_size, timeout_ms=1000):
+        # One reconnect attempt: a stale handle (dongle replugged, driver reset) fails on write/read.
+        # A device that stays silent past timeout_ms raises HidTimeout, the handle is kept.
+        for attempt in range(2):
+            try:
+                d = self.open()
+                self.drain(d, read_size)
+                with metrics.phase("write"):
+                    d.write(write_bytes)
+                with metrics.phase("read"):
+                    resp = d.read(read_size, timeout_ms)
+            except Exception:
+                metrics.count("hid_errors")
+                self.close()
+                if attempt:
+                    raise
+                metrics.count("hid_reconnects")
+                continue
+            if not resp:
+                metrics.count("hid_timeouts")
+                raise HidTimeout(f"no report within {timeout_ms} ms")
+            # hidapi hands back a list of ints; this is the only copy, decoding works on the bytes as they are
+            return resp if isinstance(resp, bytes) else bytes(resp)
+
+class HidRecorder:
+    # Append-only binary log of HID and rivalcfg traffic, replayed by bench/replay.py.
+    # File: MAGIC, then records of RECORD (wall time, call duration, type, channel, VID, PID, payload length) + payload.
+    # A channel is one opened device handle; OPEN/WRITE/MOUSE_OPEN are logged before the call, everything else after it.
+    MAGIC = b"SDHIDv1\n"
+    RECORD = struct.Struct("<dfBHHHI")
+    ENUMERATE, OPEN, WRITE, READ, ERROR, CLOSE, PROFILE, MOUSE_OPEN, MOUSE_BATTERY, CYCLE = range(1, 11)
+    NONE = 0xff
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.channels = 0
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            with open(path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    raise ValueError(f"{path} is not a HID traffic log")
+        self.file = open(path, "ab")
+        if new:
+            self.file.write(self.MAGIC)
+
+    def channel(self) -> int:
+        with self.lock:
+            self.channels = (self.channels + 1) & 0xffff
+            return self.channels
+
+    def write(self, rtype, channel=0, vendor_id=0, product_id=0, payload=b"", duration=0.0):
+        payload = bytes(payload)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(self.RECORD.pack(time.time(), duration, rtype, channel, vendor_id, product_id, len(payload)))
+            self.file.write(payload)
+            if rtype == self.CYCLE:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    @classmethod
+    def read(cls, path):
+        # Yields (timestamp, duration, type, channel, vendor_id, product_id, payload); a torn last record is dropped
+        with open(path, "rb") as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{path} is not a HID traffic log")
+            while True:
+                header = f.read(cls.RECORD.size)
+                if len(header) < cls.RECORD.size:
+                    return
+                fields = cls.RECORD.unpack(header)
+                payload = f.read(fields[-1])
+                if len(payload) < fields[-1]:
+                    return
+                yield fields[:-1] + (payload,)
+
+    @staticmethod
+    def encode_entries(entries) -> bytes:
+        return json.dumps([
+            {k: v.decode("latin-1") if isinstance(v, bytes) else v for k, v in entry.items()} for entry in entries
+        ]).encode()
+
+    @staticmethod
+    def decode_entries(payload) -> list:
+        entries = json.loads(payload)
+        for entry in entries:
+            if isinstance(entry.get("path"), str):
+                entry["path"] = entry["path"].encode("latin-1")
+        return entries
+
+class RecordingHid:
+    # Stands in for the hid module and logs everything that goes through it
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+        self.paths = {}
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        start = time.perf_counter()
+        entries = self.backend.enumerate(vendor_id, product_id)
+        self.recorder.write(HidRecorder.ENUMERATE, 0, vendor_id, product_id,
+                            HidRecorder.encode_entries(entries), time.perf_counter() - start)
+        for entry in entries:
+            self.paths[entry["path"]] = (entry["vendor_id"], entry["product_id"])
+        return entries
+
+    def device(self):
+        return RecordingDevice(self, self.backend.device())
+
+class RecordingDevice:
+    def __init__(self, owner, device):
+        self.owner = owner
+        self.recorder = owner.recorder
+        self.device = device
+        self.channel = self.recorder.channel()
+        self.ids = (0, 0)
+
+    def _call(self, rtype, fn, *args, before=b"", after=None):
+        if rtype is not None:
+            self.recorder.write(rtype, self.channel, *self.ids, before)
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.recorder.write(HidRecorder.ERROR, self.channel, *self.ids, str(e).encode(), time.perf_counter() - start)
+            raise
+        if after is not None:
+            self.recorder.write(after, self.channel, *self.ids, result or b"", time.perf_counter() - start)
+        return result
+
+    def open(self, vendor_id, product_id):
+        self.ids = (vendor_id, product_id)
+        return self._call(HidRecorder.OPEN, self.device.open, vendor_id, product_id)
+
+    def open_path(self, path):
+        self.ids = self.owner.paths.get(path, (0, 0))
+        return self._call(HidRecorder.OPEN, self.device.open_path, path, before=path)
+
+    def set_nonblocking(self, enabled):
+        return self.device.set_nonblocking(enabled)
+
+    def write(self, data):
+        return self._call(HidRecorder.WRITE, self.device.write, data, before=bytes(data))
+
+    def read(self, max_length, timeout_ms=0):
+        return self._call(None, self.device.read, max_length, timeout_ms, after=HidRecorder.READ)
+
+    def close(self):
+        self.recorder.write(HidRecorder.CLOSE, self.channel, *self.ids)
+        return self.device.close()
+
+class RecordingRivalcfg:
+    # Same for rivalcfg: profile lookups, mouse opens and battery readings
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+        self.devices = RecordingProfiles(self)
+        self.mouse = RecordingMice(self)
+
+def profile_summary(profile) -> dict:
+    # Only what the monitor looks at; full profiles hold values that are neither JSON nor picklable
+    return {k: profile[k] for k in ("name", "endpoint", "battery_level_query") if k in profile}
+
+class RecordingProfiles:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def get_profile(self, vendor_id, product_id):
+        try:
+            profile = self.owner.backend.devices.get_profile(vendor_id=vendor_id, product_id=product_id)
+        except Exception:
+            self.owner.recorder.write(HidRecorder.PROFILE, 0, vendor_id, product_id)
+            raise
+        self.owner.recorder.write(HidRecorder.PROFILE, 0, vendor_id, product_id, json.dumps(profile_summary(profile)).encode())
+        return profile
+
+class RecordingMice:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def get_mouse(self, vendor_id=STEELSERIES_VID, product_id=None):
+        recorder = self.owner.recorder
+        channel = recorder.channel()
+        recorder.write(HidRecorder.MOUSE_OPEN, channel, vendor_id, product_id)
+        start = time.perf_counter()
+        try:
+            mouse = self.owner.backend.mouse.get_mouse(vendor_id=vendor_id, product_id=product_id)
+        except Exception as e:
+            recorder.write(HidRecorder.ERROR, channel, vendor_id, product_id, str(e).encode(), time.perf_counter() - start)
+            raise
+        return RecordingMouse(mouse, recorder, channel, vendor_id, product_id)
+
+class RecordingMouse:
+    def __init__(self, mouse, recorder, channel, vendor_id, product_id):
+        self.mouse = mouse
+        self.recorder = recorder
+        self.channel = channel
+        self.ids = (vendor_id, product_id)
+
+    @property
+    def battery(self):
+        start = time.perf_counter()
+        try:
+            battery = self.mouse.battery
+        except Exception as e:
+            self.recorder.write(HidRecorder.ERROR, self.channel, *self.ids, str(e).encode(), time.perf_counter() - start)
+            raise
+        level = battery.get("level") if battery else None
+        charging = battery.get("is_charging") if battery else None
+        payload = bytes((HidRecorder.NONE if level is None else level, HidRecorder.NONE if charging is None else int(charging)))
+        self.recorder.write(HidRecorder.MOUSE_BATTERY, self.channel, *self.ids, payload, time.perf_counter() - start)
+        return battery
+
+    def close(self):
+        self.recorder.write(HidRecorder.CLOSE, self.channel, *self.ids)
+        self.mouse.close()
+
+def hid_worker_main(conn):
+    # Runs in the worker process, which owns every hid and rivalcfg handle and answers one request at a time.
+    # The backends are imported here rather than taken from the globals, which the parent may have swapped for proxies.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handles = {}
+
+    def keep(obj):
+        handles[id(obj)] = obj
+        return id(obj)
+
+    def run(op, args):
+        if op == "enumerate":
+            return importlib.import_module("hid").enumerate(*args)
+        if op == "device":
+            return keep(importlib.import_module("hid").device())
+        if op == "profile":
+            profiles = importlib.import_module("rivalcfg").devices
+            return profile_summary(profiles.get_profile(vendor_id=args[0], product_id=args[1]))
+        if op == "mouse":
+            return keep(importlib.import_module("rivalcfg").mouse.get_mouse(vendor_id=args[0], product_id=args[1]))
+        obj = handles[args[0]]
+        if op == "battery":
+            return obj.battery
+        if op == "close":
+            del handles[args[0]]
+            return obj.close()
+        if op in ("open", "open_path", "set_nonblocking", "write", "read"):
+            return getattr(obj, op)(*args[1:])
+        raise ValueError(f"unknown request {op}")
+
+    while True:
+        try:
+            op, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = (True, run(op, args))
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        conn.send(reply)
+
+class HidWorker:
+    # Supervises the worker process. A request that gets no answer in time means a native call hung: the
+    # process is killed and the next request starts a fresh one. Handles from the old process fail with IOError,
+    # which the usual reopen paths already deal with.
+    start_method = "spawn"
+
+    def __init__(self, timeout=2.0):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.generation = 0
+        self.restarts = 0
+        self.closed = False
+
+    def start(self):
+        context = multiprocessing.get_context(self.start_method)
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=hid_worker_main, args=(child,), name="hid-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.generation += 1
+
+    def stop(self):
+        with self.lock:
+            self.closed = True
+            self.kill()
+
+    def kill(self):
+        if self.process is None:
+            return
+        self.conn.close()
+        # Without its pipe a healthy worker exits on its own; a hung one is killed
+        self.process.join(0.5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1)
+        self.process = None
+
+    def restart(self):
+        self.kill()
+        self.restarts += 1
+        metrics.count("hid_worker_restarts")
+
+    def call(self, op, *args, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self.lock:
+            if self.closed:
+                raise IOError("HID worker stopped")
+            if self.process is not None and not self.process.is_alive():
+                self.restart()
+            if self.process is None:
+                self.start()
+            try:
+                self.conn.send((op, args))
+                reply = self.conn.recv() if self.conn.poll(timeout) else None
+            except (EOFError, OSError) as e:
+                self.restart()
+                raise IOError(f"HID worker died during {op}: {e}")
+            if reply is None:
+                self.restart()
+                raise HidTimeout(f"HID worker did not answer {op} within {timeout:.1f} s, restarted")
+        ok, result = reply
+        if not ok:
+            raise IOError(result)
+        return result
+
+class WorkerHid:
+    # Stands in for the hid module; the calls are carried out by the HID worker process
+    def __init__(self, worker):
+        self.worker = worker
+
+    def enumerate(self, vendor_id=0, product_id=0):
+        return self.worker.call("enumerate", vendor_id, product_id)
+
+    def device(self):
+        return WorkerHandle(self.worker, "device")
+
+class WorkerRivalcfg:
+    # Same for rivalcfg: rivalcfg.devices.get_profile and rivalcfg.mouse.get_mouse both land here
+    def __init__(self, worker):
+        self.worker = worker
+        self.devices = self.mouse = self
+
+    def get_profile(self, vendor_id, product_id):
+        return self.worker.call("profile", vendor_id, product_id)
+
+    def get_mouse(self, vendor_id=STEELSERIES_VID, product_id=None):
+        return WorkerHandle(self.worker, "mouse", vendor_id, product_id)
+
+class WorkerHandle:
+    # A hid device or rivalcfg mouse held by the worker; dead once that worker has been restarted
+    def __init__(self, worker, op, *args):
+        self.worker = worker
+        self.handle = worker.call(op, *args)
+        self.generation = worker.generation
+
+    def _call(self, op, *args, timeout=None):
+        if self.generation != self.worker.generation:
+            raise IOError("HID worker was restarted")
+        return self.worker.call(op, self.handle, *args, timeout=timeout)
+
+    def open(self, vendor_id, product_id):
+        return self._call("open", vendor_id, product_id)
+
+    def open_path(self, path):
+        return self._call("open_path", path)
+
+    def set_nonblocking(self, enabled):
+        return self._call("set_nonblocking", enabled)
+
+    def write(self, data):
+        return self._call("write", data)
+
+    def read(self, max_length, timeout_ms=0):
+        return self._call("read", max_length, timeout_ms, timeout=self.worker.timeout + timeout_ms / 1000)
+
+    @property
+    def battery(self):
+        return self._call("battery")
+
+    def close(self):
+        if self.generation == self.worker.generation:
+            self._call("close")
+
+class TimerHandle:
+    __slots__ = ("deadline", "latest", "fn", "interval", "tolerance")
+
+    def __init__(self, deadline, tolerance, fn, interval=None):
+        self.deadline = deadline
+        self.latest = deadline + tolerance
+        self.fn = fn
+        self.interval = interval
+        self.tolerance = tolerance
+
+    def cancel(self):
+        self.fn = None
+
+class TimerService:
+    # Every timed wakeup in the process goes through this one thread. A timer may fire up to its tolerance
+    # late: the thread sleeps until the earliest latest-allowed time and then fires everything already due,
+    # so timers that fall due close together share a single wakeup.
+    def __init__(self, tolerance=1.0):
+        self.tolerance = tolerance
+        self.heap = []
+        self.sequence = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.wakeups = 0
+        self.started = time.monotonic()
+
+    def start(self):
+        self.running = True
+        self.started = time.monotonic()
+        threading.Thread(target=self._run, name="timers", daemon=True).start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def call_at(self, when, fn, tolerance=None, interval=None) -> TimerHandle:
+        handle = TimerHandle(when, self.tolerance if tolerance is None else tolerance, fn, interval)
+        self._push(handle)
+        return handle
+
+    def call_later(self, delay, fn, tolerance=None) -> TimerHandle:
+        return self.call_at(time.monotonic() + delay, fn, tolerance)
+
+    def every(self, interval, fn, tolerance=None) -> TimerHandle:
+        return self.call_at(time.monotonic() + interval, fn, tolerance, interval)
+
+    def _push(self, handle):
+        with self.cond:
+            self.sequence += 1
+            heapq.heappush(self.heap, (handle.latest, self.sequence, handle))
+            self.cond.notify()
+
+    def wakeups_per_hour(self) -> float:
+        return self.wakeups * 3600 / max(1.0, time.monotonic() - self.started)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    while self.heap and self.heap[0][2].fn is None:
+                        heapq.heappop(self.heap)
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    self.cond.wait(None if not self.heap else self.heap[0][0] - now)
+                # Not just the timer that ran out: everything whose deadline has passed goes in this wakeup
+                due = [entry[2] for entry in self.heap if entry[2].deadline <= now]
+                self.heap = [entry for entry in self.heap if entry[2].deadline > now]
+                heapq.heapify(self.heap)
+                self.wakeups += 1
+            metrics.count("timer_wakeups")
+            for handle in due:
+                fn = handle.fn
+                if fn is None:
+                    continue
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Error in timer callback: {e}")
+                if handle.interval and handle.fn is not None:
+                    handle.deadline = max(now, handle.deadline) + handle.interval
+                    handle.latest = handle.deadline + handle.tolerance
+                    self._push(handle)
+
+class PollPool:
+    # Daemon workers, unlike ThreadPoolExecutor, so a hung driver call cannot block interpreter exit
+    def __init__(self, workers=4):
+        self.tasks = queue.Queue()
+        self.workers = 0
+        self.resize(workers)
+
+    def resize(self, workers):
+        # Only grows; idle workers just block on the queue
+        while self.workers < workers:
+            threading.Thread(target=self._worker, name=f"poll-{self.workers}", daemon=True).start()
+            self.workers += 1
+
+    def _worker(self):
+        while True:
+            future, fn = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self.tasks.put((future, fn))
+        return future
+
+def inotify_watch(directory, mask, running, callback):
+    # Linux only: blocks on inotify for directory and calls callback(event mask, file name) while running() holds.
+    # Raises OSError where inotify is not available.
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init()
+    if fd < 0 or libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+        raise OSError(ctypes.get_errno(), "inotify unavailable")
+    try:
+        while running():
+            buf = os.read(fd, 4096)
+            offset = 0
+            while offset < len(buf):
+                _, event, _, length = struct.unpack_from("iIII", buf, offset)
+                name = buf[offset + 16:offset + 16 + length].rstrip(b"\0").decode(errors="replace")
+                offset += 16 + length
+                callback(event, name)
+    finally:
+        os.close(fd)
+
+class HidrawEventSource:
+    # Linux hotplug feed: inotify on /dev for hidraw nodes, falling back to comparing the node list every few seconds
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    def __init__(self, directory="/dev", poll_interval=5.0, timers=None):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.timers = timers
+        self.timer = None
+        self.running = False
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith("linux") and os.path.isdir("/dev")
+
+    def start(self, callback):
+        self.running = True
+        threading.Thread(target=self._run, args=(callback,), name="hotplug", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def _run(self, callback):
+        try:
+            self._watch_inotify(callback)
+        except Exception:
+            self._watch_listdir(callback)
+
+    def _watch_inotify(self, callback):
+        def on_event(mask, name):
+            if name.startswith("hidraw"):
+                callback("add" if mask & self.IN_CREATE else "remove", os.path.join(self.directory, name))
+        inotify_watch(self.directory, self.IN_CREATE | self.IN_DELETE, lambda: self.running, on_event)
+
+    def _watch_listdir(self, callback):
+        def nodes():
+            return {n for n in os.listdir(self.directory) if n.startswith("hidraw")}
+        known = [nodes()]
+
+        def check():
+            current = nodes()
+            for name in current - known[0]:
+                callback("add", os.path.join(self.directory, name))
+            for name in known[0] - current:
+                callback("remove", os.path.join(self.directory, name))
+            known[0] = current
+        if self.timers is not None:
+            self.timer = self.timers.every(self.poll_interval, check)
+            return
+        while self.running:
+            time.sleep(self.poll_interval)
+            check()
+
+class SimulatedEventSource:
+    # Stand-in hotplug feed, call emit() to inject add/remove events
+    def __init__(self):
+        self.callback = None
+
+    def start(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+    def emit(self, action, path=None):
+        if self.callback:
+            self.callback(action, path)
+
+class DeviceDiscovery:
+    def __init__(self, vendor_id=STEELSERIES_VID, event_source=None, rescan_interval=900, on_change=None):
+        self.vendor_id = vendor_id
+        self.event_source = event_source
+        self.rescan_interval = rescan_interval
+        self.on_change = on_change
+        self.devices = []
+        self.generation = 0
+        self.last_scan = None
+        self.dirty = True
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.event_source is not None:
+            self.event_source.start(self.on_event)
+
+    def stop(self):
+        if self.event_source is not None:
+            self.event_source.stop()
+
+    def on_event(self, action, path=None):
+        self.dirty = True
+        if self.on_change:
+            self.on_change(action, path)
+
+    def invalidate(self):
+        self.dirty = True
+
+    def next_scan(self) -> float:
+        # When the next periodic rescan is due; without hotplug events it is the only way new devices show up
+        return time.monotonic() if self.last_scan is None else self.last_scan + self.rescan_interval
+
+    def enumerate(self) -> list:
+        with self.lock:
+            stale = self.last_scan is None or time.monotonic() - self.last_scan >= self.rescan_interval
+            if self.dirty or stale:
+                self.rescan()
+            return self.devices
+
+    def rescan(self):
+        self.dirty = False
+        self.last_scan = time.monotonic()
+        with metrics.phase("enumerate"):
+            devices = hid.enumerate(self.vendor_id)
+        if {d['path'] for d in devices} != {d['path'] for d in self.devices}:
+            self.generation += 1
+        self.devices = devices
+
+class BatteryHistory:
+    # Memory-mapped ring buffers of (timestamp, level, charging) records in tiers of growing coarseness.
+    # Tier 0 keeps raw samples; each coarser tier averages the tier before it over its bucket length,
+    # so a file has a fixed size and covers months of uptime.
+    MAGIC = b"SDHIST1\0"
+    TIERS = ((0, 2880), (600, 2016), (7200, 4380))
+    HEADER = struct.Struct("<8sII")
+    TIER_HEADER = struct.Struct("<IIIIddIB3x")
+    RECORD = struct.Struct("<dBB")
+    NONE = 0xff
+
+    def __init__(self, path):
+        self.path = path
+        self.data_offset = self.HEADER.size + self.TIER_HEADER.size * len(self.TIERS)
+        offsets = []
+        offset = self.data_offset
+        for _, capacity in self.TIERS:
+            offsets.append(offset)
+            offset += capacity * self.RECORD.size
+        self.offsets = offsets
+        self.size = offset
+        self.lock = threading.Lock()
+        fresh = not os.path.exists(path) or os.path.getsize(path) != self.size
+        self.file = open(path, "w+b" if fresh else "r+b")
+        if fresh:
+            self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        if fresh or self.HEADER.unpack_from(self.map, 0) != (self.MAGIC, 1, len(self.TIERS)):
+            self.reset()
+        self.tiers = [list(self.TIER_HEADER.unpack_from(self.map, self._tier_header(i))) for i in range(len(self.TIERS))]
+
+    def _tier_header(self, tier):
+        return self.HEADER.size + tier * self.TIER_HEADER.size
+
+    def reset(self):
+        self.map[:] = bytes(self.size)
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, 1, len(self.TIERS))
+        for i, (bucket, capacity) in enumerate(self.TIERS):
+            self.TIER_HEADER.pack_into(self.map, self._tier_header(i), capacity, 0, 0, bucket, -1.0, 0.0, 0, self.NONE)
+
+    def _write(self, tier, timestamp, level, charging):
+        capacity, head, count, bucket, acc_start, acc_sum, acc_n, acc_charging = self.tiers[tier]
+        self.RECORD.pack_into(self.map, self.offsets[tier] + head * self.RECORD.size, timestamp, level, charging)
+        self.tiers[tier][1] = (head + 1) % capacity
+        self.tiers[tier][2] = min(count + 1, capacity)
+        if tier + 1 < len(self.TIERS):
+            self._accumulate(tier + 1, timestamp, level, charging)
+
+    def _accumulate(self, tier, timestamp, level, charging):
+        state = self.tiers[tier]
+        bucket = state[3]
+        start = timestamp - timestamp % bucket
+        if state[4] >= 0 and start != state[4] and state[6]:
+            self._write(tier, state[4], round(state[5] / state[6]), state[7])
+        if start != state[4]:
+            state[4:8] = [start, 0.0, 0, self.NONE]
+        if level != self.NONE:
+            state[5] += level
+            state[6] += 1
+            state[7] = charging
+
+    def append(self, timestamp, level, charging):
+        level = self.NONE if level is None else max(0, min(100, int(level)))
+        charging = self.NONE if charging is None else int(bool(charging))
+        with self.lock:
+            self._write(0, timestamp, level, charging)
+            for i, state in enumerate(self.tiers):
+                self.TIER_HEADER.pack_into(self.map, self._tier_header(i), *state)
+
+    def records(self, tier=0) -> list:
+        with self.lock:
+            capacity, head, count = self.tiers[tier][:3]
+            result = []
+            for i in range(head - count, head):
+                ts, level, charging = self.RECORD.unpack_from(self.map, self.offsets[tier] + (i % capacity) * self.RECORD.size)
+                result.append((ts, None if level == self.NONE else level, None if charging == self.NONE else bool(charging)))
+            return result
+
+    def close(self):
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+class HistoryStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.histories = {}
+
+    def get(self, kind, name) -> BatteryHistory:
+        key = (kind, name)
+        history = self.histories.get(key)
+        if history is None:
+            os.makedirs(self.directory, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{kind}_{name}").strip("_").lower()
+            history = self.histories[key] = BatteryHistory(os.path.join(self.directory, f"{slug}.bin"))
+        return history
+
+    def record(self, kind, status, timestamp=None, name=None):
+        if not status.is_connected or status.battery_level is None:
+            return
+        self.get(kind, name or status.name).append(time.time() if timestamp is None else timestamp, status.battery_level, status.is_charging)
+
+    def close(self):
+        for history in self.histories.values():
+            history.close()
+        self.histories = {}
+
+class DischargeEstimator:
+    # Exponentially weighted least-squares fit of level over time, updated in O(1) per reading.
+    # Only readings where the level drops are fitted: a coarse headset sits on one 25% step for hours
+    # and only the moment it steps down says anything about the rate.
+    def __init__(self, half_life=6 * 3600):
+        self.tau = half_life / math.log(2)
+        self.charging = None
+        self.reset()
+
+    def reset(self):
+        self.origin = None
+        self.last_time = None
+        self.last_level = None
+        self.points = 0
+        self.w = self.st = self.sl = self.stt = self.stl = 0.0
+
+    def _add(self, t, level):
+        if self.origin is None:
+            self.origin = t
+        x = (t - self.origin) / 3600.0
+        if self.last_time is not None:
+            decay = math.exp(-(t - self.last_time) / self.tau)
+            self.w *= decay
+            self.st *= decay
+            self.sl *= decay
+            self.stt *= decay
+            self.stl *= decay
+        self.w += 1
+        self.st += x
+        self.sl += level
+        self.stt += x * x
+        self.stl += x * level
+        self.last_time = t
+        self.points += 1
+
+    def update(self, t, level, charging=None, step=1):
+        if level is None:
+            return
+        charging = bool(charging)
+        if charging != self.charging:
+            self.reset()
+            self.charging = charging
+        if charging:
+            return
+        if self.last_level is None:
+            # On a coarse device the first reading is somewhere inside a step, not at its edge
+            if step <= 1:
+                self._add(t, level)
+        elif level > self.last_level:
+            # Headsets do not report charging, a rising level means it was charged in between
+            self.reset()
+        elif level < self.last_level:
+            self._add(t, level)
+        self.last_level = level
+
+    def rate(self) -> Optional[float]:
+        # Percent per hour, negative while discharging
+        if self.points < 2:
+            return None
+        denominator = self.w * self.stt - self.st * self.st
+        if denominator <= 1e-12:
+            return None
+        return (self.w * self.stl - self.st * self.sl) / denominator
+
+    def time_to_empty(self, now) -> Optional[float]:
+        slope = self.rate()
+        if self.charging or slope is None or slope >= 0:
+            return None
+        intercept = (self.sl - slope * self.st) / self.w
+        empty_at = self.origin + (-intercept / slope) * 3600.0
+        return max(0.0, empty_at - now)
+
+def format_duration(seconds) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    minutes -= minutes % 10
+    return f"{hours}h {minutes:02d}m" if minutes else f"{hours}h"
 
 @dataclass
 class DeviceStatus:
@@ -55,42 +1376,726 @@ class DeviceStatus:
     battery_level: Optional[int] = None
     is_charging: Optional[bool] = None
     is_connected: bool = False
+    is_degraded: bool = False
 
-class BatteryMonitor:
+@dataclass
+class MouseDescriptor:
+    name: str
+    vendor_id: int
+    product_id: int
+    profile: Optional[dict] = None
+    interface_number: Optional[int] = None
+    step: int = 1
+
+class DeviceState:
+    # Everything the monitor keeps per physical device
+    __slots__ = ("id", "kind", "model", "path", "session", "status", "fail_count", "estimator", "inflight", "polled_at")
+
+    def __init__(self, device_id, kind, model, path=None):
+        self.id = device_id
+        self.kind = kind
+        self.model = model
+        self.path = path
+        self.session = None
+        self.status = DeviceStatus(model.name)
+        self.fail_count = 0
+        self.estimator = DischargeEstimator()
+        self.inflight = None
+        self.polled_at = None
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+class StatusBus:
+    # Fans out device status changes. Subscribers are called on the publishing thread and hand the work
+    # to their own thread; a publish that changes nothing calls nobody.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.last = {}
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def publish(self, statuses: dict, force=False):
+        # statuses maps device id to what is shown for it; the changes reach subscribers, None for a removed device
+        with self.lock:
+            changes = {key: value for key, value in statuses.items() if self.last.get(key) != value}
+            changes.update((key, None) for key in self.last if key not in statuses)
+            self.last = dict(statuses)
+            subscribers = list(self.subscribers)
+        if not changes and not force:
+            return
+        metrics.count("status_changes")
+        for callback in subscribers:
+            try:
+                callback(changes)
+            except Exception as e:
+                print(f"Error in status subscriber: {e}")
+
+class CoalescingWorker:
+    # One thread that runs fn after every poke; pokes that arrive while it is busy fold into a single run
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.event = threading.Event()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+
+    def poke(self):
+        self.event.set()
+
+    def _run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            if not self.running:
+                return
+            try:
+                self.fn()
+            except Exception as e:
+                print(f"Error in {self.name} worker: {e}")
+
+class TelemetryExporter:
+    # Opt-in fleet reporting: status changes are batched (latest per device), deflated and POSTed to
+    # src/aggregator.py. Batches the collector did not take wait in the spool and go out oldest first
+    # after the next successful post.
+    MAX_SPOOL_FILES = 1000
+
+    def __init__(self, url, spool_dir, agent, interval=60, timeout=5.0, timers=None):
+        self.url = url
+        self.timers = timers
+        self.timer = None
+        self.spool_dir = spool_dir
+        self.agent = agent
+        self.interval = interval
+        self.timeout = timeout
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+        if self.thread is not None:
+            self.thread.join(self.timeout * 2)
+
+    def on_status_changed(self, changes):
+        now = time.time()
+        with self.lock:
+            for device_id, shown in changes.items():
+                record = {"device_id": device_id, "kind": device_id.split(":")[0], "timestamp": now}
+                if shown is None:
+                    record["removed"] = True
+                else:
+                    status, left = shown
+                    record.update(asdict(status), time_left=left)
+                self.pending[device_id] = record
+            # The first change opens the batch window, the post goes out when it closes
+            if self.timers is None:
+                self.changed.set()
+            elif self.timer is None:
+                self.timer = self.timers.call_later(self.interval, self.changed.set, tolerance=self.interval / 2)
+
+    def _run(self):
+        # Sleeps until a batch is due; without a timer service it waits out the batch window itself
+        while not self.stopped.is_set():
+            self.changed.wait()
+            if self.timers is None:
+                self.stopped.wait(self.interval)
+            self.changed.clear()
+            with self.lock:
+                self.timer = None
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            records, self.pending = list(self.pending.values()), {}
+        payload = None
+        if records:
+            payload = zlib.compress(json.dumps({"agent": self.agent, "sent": time.time(), "records": records}).encode())
+        # Older batches go first, so the collector never sees a level step back in time
+        if self.drain_spool() and payload is not None and self.post(payload):
+            metrics.count("telemetry_records", len(records))
+        elif payload is not None:
+            self.spool(payload)
+
+    def post(self, payload) -> bool:
+        request = urlrequest.Request(self.url, data=payload, method="POST", headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "deflate",
+        })
+        try:
+            with urlrequest.urlopen(request, timeout=self.timeout) as response:
+                ok = 200 <= response.status < 300
+        except (OSError, ValueError) as e:
+            ok = False
+            print(f"Error sending telemetry: {e}")
+        if not ok:
+            metrics.count("telemetry_failures")
+        return ok
+
+    def spool(self, payload):
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            path = os.path.join(self.spool_dir, f"{time.time_ns():020d}.jsonz")
+            with open(path + ".tmp", "wb") as f:
+                f.write(payload)
+            os.replace(path + ".tmp", path)
+            names = self.spooled()
+            for name in names[:max(0, len(names) - self.MAX_SPOOL_FILES)]:
+                os.unlink(os.path.join(self.spool_dir, name))
+                metrics.count("telemetry_dropped")
+        except OSError as e:
+            print(f"Error spooling telemetry: {e}")
+
+    def spooled(self) -> list:
+        try:
+            return sorted(n for n in os.listdir(self.spool_dir) if n.endswith(".jsonz"))
+        except OSError:
+            return []
+
+    def drain_spool(self) -> bool:
+        for name in self.spooled():
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+            except OSError:
+                continue
+            if not self.post(payload):
+                return False
+            os.unlink(path)
+        return True
+
+class RenderCache:
+    # LRU of rendered tray artifacts keyed by their visible content
+    def __init__(self, name, render, maxsize=32):
+        self.name = name
+        self.render = render
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            with metrics.phase(self.name):
+                item = self.items[key] = self.render(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        else:
+            self.items.move_to_end(key)
+        return item
+
+class PollScheduler:
+    # Heap of per-device due times; a device's entry is valid only while it matches self.due[kind]
     def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.anchors = {}
+        self.slopes = {}
+
+    def schedule(self, kind, when):
+        self.due[kind] = when
+        heapq.heappush(self.heap, (when, kind))
+
+    def unschedule(self, kind):
+        self.due.pop(kind, None)
+        self.anchors.pop(kind, None)
+        self.slopes.pop(kind, None)
+
+    def pop_due(self, now) -> list:
+        kinds = []
+        while self.heap and self.heap[0][0] <= now:
+            when, kind = heapq.heappop(self.heap)
+            if self.due.get(kind) == when:
+                del self.due[kind]
+                kinds.append(kind)
+        return kinds
+
+    def next_due(self) -> Optional[float]:
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def observe(self, kind, status, now):
+        # Discharge slope in percent per second, measured between level changes
+        level = status.battery_level
+        anchor = self.anchors.get(kind)
+        if not status.is_connected or level is None or status.is_charging or (anchor and level > anchor[1]):
+            self.anchors.pop(kind, None)
+            self.slopes.pop(kind, None)
+            if status.is_connected and level is not None and not status.is_charging:
+                self.anchors[kind] = (now, level)
+            return
+        if anchor is None:
+            self.anchors[kind] = (now, level)
+        elif level < anchor[1] and now > anchor[0]:
+            rate = (anchor[1] - level) / (now - anchor[0])
+            previous = self.slopes.get(kind)
+            self.slopes[kind] = rate if previous is None else (previous + rate) / 2
+            self.anchors[kind] = (now, level)
+
+    def interval_for(self, kind, status, base, min_interval, max_interval) -> float:
+        level = status.battery_level
+        if not status.is_connected or level is None or status.is_charging:
+            interval = base
+        else:
+            slope = self.slopes.get(kind)
+            if slope:
+                # Sample several times before the device reaches the low threshold, more often once it is below
+                if level > LOW_BATTERY:
+                    interval = (level - LOW_BATTERY) / slope / 4
+                else:
+                    interval = level / slope / 8
+            elif level >= 50:
+                interval = base * 2
+            elif level >= LOW_BATTERY:
+                interval = base
+            else:
+                interval = base / 2
+        return max(min_interval, min(max_interval, interval))
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(runtime_dir, f"steeldevice-{user}.sock")
+
+class StatusServer:
+    # Line-delimited JSON over a Unix socket. Commands: "status" (one snapshot), "subscribe"
+    # (snapshot now, then one per change), "refresh" (ask the poller for a new reading).
+    def __init__(self, monitor, path):
+        self.monitor = monitor
+        self.path = path
+        self.sock = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.last_published = None
+        self.unsubscribe = None
+
+    def start(self):
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("Unix sockets are not supported on this platform")
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError(f"another instance is already serving {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(16)
+        threading.Thread(target=self._accept, name="ipc", daemon=True).start()
+        self.unsubscribe = self.monitor.status_bus.subscribe(lambda changes: self.publish(self.monitor.status_snapshot()))
+
+    def stop(self):
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        with self.lock:
+            for conn in self.subscribers:
+                conn.close()
+            self.subscribers = []
+
+    def _accept(self):
+        while self.sock is not None:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            for line in conn.makefile("r"):
+                command = line.strip()
+                if command == "status":
+                    conn.sendall(self._encode(self.monitor.status_snapshot()))
+                elif command == "subscribe":
+                    # Subscribers are written without blocking, from the first snapshot on
+                    conn.setblocking(False)
+                    with self.lock:
+                        if self._push(conn, self._encode(self.monitor.status_snapshot())):
+                            self.subscribers.append(conn)
+                    return
+                elif command == "refresh":
+                    self.monitor.request_refresh()
+                    conn.sendall(self._encode({"ok": True}))
+                elif command == "profile":
+                    conn.sendall(self._encode(self.monitor.profile_cycle()))
+                else:
+                    conn.sendall(self._encode({"error": f"unknown command: {command}"}))
+        except OSError:
+            pass
+        conn.close()
+
+    @staticmethod
+    def _encode(data) -> bytes:
+        return (json.dumps(data) + "\n").encode()
+
+    def publish(self, snapshot):
+        devices = snapshot["devices"]
+        if devices == self.last_published:
+            return
+        self.last_published = devices
+        payload = self._encode(snapshot)
+        with self.lock:
+            for conn in list(self.subscribers):
+                if not self._push(conn, payload):
+                    self.subscribers.remove(conn)
+
+    @staticmethod
+    def _push(conn, payload) -> bool:
+        # Runs on the monitor thread: a subscriber that stopped reading and filled its socket buffer is dropped
+        # rather than stalling the poller, and a line that only partly fit would be garbled anyway
+        try:
+            sent = conn.send(payload)
+        except OSError:
+            sent = 0
+        if sent < len(payload):
+            conn.close()
+            return False
+        return True
+
+def query_status(path, command="status", timeout=2.0):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall(f"{command}\n".encode())
+        return json.loads(client.makefile("r").readline())
+    finally:
+        client.close()
+
+def default_config_path() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(base, "SteelDevice", "config.json")
+
+def valid_setting(key, default, value) -> bool:
+    if key in CONFIG_CHOICES:
+        return value in CONFIG_CHOICES[key]
+    if key.startswith("colors."):
+        return isinstance(value, str) and COLOR_RE.fullmatch(value) is not None
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, (int, float)):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= CONFIG_MINIMUMS.get(key, 0)
+    return isinstance(value, type(default))
+
+def merge_config(defaults, loaded, prefix="") -> Tuple[dict, list]:
+    # Deep merge over the defaults; a value of the wrong type or out of range falls back to the default.
+    # Keys the defaults do not know are kept, so a config written by a newer version survives a save.
+    merged, rejected = {}, []
+    for key, default in defaults.items():
+        name = prefix + key
+        if key not in loaded:
+            merged[key] = copy.deepcopy(default)
+        elif isinstance(default, dict) and isinstance(loaded[key], dict):
+            merged[key], bad = merge_config(default, loaded[key], name + ".")
+            rejected.extend(bad)
+        elif not isinstance(default, dict) and valid_setting(name, default, loaded[key]):
+            merged[key] = loaded[key]
+        else:
+            merged[key] = copy.deepcopy(default)
+            rejected.append(name)
+    for key, value in loaded.items():
+        if key not in defaults:
+            merged[key] = value
+    return merged, rejected
+
+class ConfigStore:
+    # Saves are debounced and atomic (temp file + rename); the file is re-read when its mtime changes.
+    # On Linux inotify reports edits without any wakeups in between. Elsewhere the mtime is checked every
+    # poll_interval, with as much slack again so the check can ride along with a poll: at most 12 wakeups
+    # an hour with the defaults, usually none of its own.
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, path=None, on_change=None, save_delay=1.0, poll_interval=300.0, timers=None):
+        self.path = path or default_config_path()
+        self.timers = timers
+        self.watcher = None
+        self.on_change = on_change
+        self.save_delay = save_delay
+        self.poll_interval = poll_interval
+        self.mtime = None
+        self.pending = None
+        self.timer = None
+        self.lock = threading.Lock()
+        self.running = False
+
+    def stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self) -> dict:
+        # At startup an unreadable file means the defaults
+        try:
+            return self.read()
+        except (OSError, ValueError) as e:
+            print(f"Error loading config: {e}")
+        return copy.deepcopy(DEFAULT_CONFIG)
+
+    def read(self) -> dict:
+        # Raises OSError or ValueError when the file cannot be read or is not valid JSON
+        path = self.path
+        # Earlier versions kept the file in the working directory
+        if not os.path.exists(path) and os.path.exists(CONFIG_FILE):
+            path = CONFIG_FILE
+        if not os.path.exists(path):
+            return copy.deepcopy(DEFAULT_CONFIG)
+        self.mtime = self.stat()
+        with open(path, 'r') as f:
+            loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ValueError("config is not a JSON object")
+        config, rejected = merge_config(DEFAULT_CONFIG, loaded)
+        for key in rejected:
+            print(f"Invalid config value for {key}, using the default")
+        if path != self.path:
+            try:
+                self.write(config)
+            except OSError as e:
+                print(f"Error moving config to {self.path}: {e}")
+        return config
+
+    def write(self, config):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self.mtime = self.stat()
+
+    def save(self, config):
+        # Rapid changes (dragging through settings, several Apply clicks) end up as one write
+        with self.lock:
+            self.pending = copy.deepcopy(config)
+            if self.timer is not None:
+                self.timer.cancel()
+            if self.timers is not None:
+                self.timer = self.timers.call_later(self.save_delay, self.flush, tolerance=self.save_delay)
+            else:
+                self.timer = threading.Timer(self.save_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            config, self.pending = self.pending, None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if config is None:
+                return
+            try:
+                self.write(config)
+            except Exception as e:
+                print(f"Error saving config: {e}")
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._watch, name="config", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        if self.watcher is not None:
+            self.watcher.cancel()
+
+    def _watch(self):
+        if sys.platform.startswith("linux"):
+            directory, name = os.path.split(self.path)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                # Written in place (close after write) or replaced by a rename, as this store and most editors do
+                inotify_watch(directory, self.IN_CLOSE_WRITE | self.IN_MOVED_TO, lambda: self.running,
+                              lambda mask, changed: changed == name and self.check())
+                return
+            except OSError:
+                pass
+        if self.timers is not None:
+            self.watcher = self.timers.every(self.poll_interval, self.check, tolerance=self.poll_interval)
+            return
+        while self.running:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    def check(self):
+        mtime = self.stat()
+        if mtime is None or mtime == self.mtime or self.pending is not None:
+            return
+        # A half-written file or a typo keeps the running config; the next edit is picked up as usual
+        try:
+            config = self.read()
+        except (OSError, ValueError) as e:
+            print(f"Ignoring config change, the file does not load: {e}")
+            return
+        if self.on_change:
+            self.on_change(config)
+
+class BatteryMonitor:
+    def __init__(self, config_path=None):
+        self.timers = TimerService()
+        self.config_store = ConfigStore(config_path, on_change=self.on_config_file_changed, timers=self.timers)
         self.config = self.load_config()
-        self.mouse_status = DeviceStatus("Mouse")
-        self.headphone_status = DeviceStatus("Headphones")
+        self.timers.tolerance = self.config.get("timer_tolerance", 5)
+        self.poll_timer = None
+        self.devices = {}
+        self.synced_generation = None
         self.last_headphone_battery = None
         self.tray_icon = None
         self.settings_window = None
         self.running = True
         self.update_event = threading.Event()
-        self.mouse_fail_count = 0
-        self.headphone_fail_count = 0
-        if self.config.get("autostart", True):
-            self.setup_autostart()
+        self.poll_requested = False
+        self.retime_pending = False
+        self.refresh_lock = threading.Lock()
+        self.refresh_pending = None
+        self.refresh_running = None
+        self.refresh_notice = None
+        self.registry = DeviceRegistry()
+        self.poll_pool = PollPool()
+        self.discovery = DeviceDiscovery(
+            event_source=HidrawEventSource(timers=self.timers) if HidrawEventSource.available() else None,
+            rescan_interval=self.config.get("discovery_rescan_interval", 900),
+            on_change=self.on_hotplug,
+        )
+        self.scheduler = PollScheduler()
+        self.icon_cache = RenderCache("render_icon", self.render_icon, maxsize=64)
+        self.menu_cache = RenderCache("render_menu", self.render_menu, maxsize=16)
+        self.tray_state = {}
+        self.status_bus = StatusBus()
+        self.tray_worker = CoalescingWorker("tray", self.update_tray)
+        self.metrics_server = None
+        self.telemetry = None
+        self.history = None
+        self.history_error = None
+        if self.config.get("history_enabled", True):
+            self.history = HistoryStore(os.path.join(os.path.dirname(self.config_store.path), HISTORY_DIR))
+        metrics.enabled = self.config.get("metrics_enabled", False)
+        self.status_server = None
+        self.profiler = None
+        if self.config.get("profile_cycles"):
+            self.profiler = CycleProfiler(self.config["profile_cycles"], self.config.get("profile_dir", ""))
+        self.hid_worker = None
+        if self.config.get("hid_worker"):
+            self.start_hid_worker()
+        self.recorder = None
+        if self.config.get("hid_record_file"):
+            self.start_recording(self.config["hid_record_file"])
 
-    def load_config(self):
+    def start_hid_worker(self):
+        # Opt-in: device I/O moves to a child process that can be killed when a driver call hangs.
+        # Polls go through it one at a time; readings still land in DeviceState as before.
+        global hid, rivalcfg
+        if self.hid_worker is not None:
+            return
+        self.hid_worker = HidWorker(timeout=max(2.0, self.config.get("hid_timeout_ms", 1000) / 1000 + 1))
+        hid = WorkerHid(self.hid_worker)
+        rivalcfg = WorkerRivalcfg(self.hid_worker)
+
+    def start_recording(self, path):
+        # Opt-in: every HID and rivalcfg call from here on is appended to path
+        global hid, rivalcfg
+        if self.recorder is not None:
+            return
         try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r') as f:
-                    config = json.load(f)
-                merged = DEFAULT_CONFIG.copy()
-                merged.update(config)
-                return merged
-        except Exception as e:
-            print(f"Error loading config: {e}")
-        return DEFAULT_CONFIG.copy()
+            self.recorder = HidRecorder(path)
+        except (OSError, ValueError) as e:
+            print(f"Error opening HID record file: {e}")
+            return
+        hid = RecordingHid(hid, self.recorder)
+        rivalcfg = RecordingRivalcfg(rivalcfg, self.recorder)
+
+    def load_config(self):
+        return self.config_store.load()
 
     def save_config(self):
-        try:
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(self.config, f, indent=2)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+        self.config_store.save(self.config)
+
+    def update_config(self, config):
+        self.apply_config(config)
+        self.save_config()
+
+    def on_config_file_changed(self, config):
+        if config != self.config:
+            if self.config.get("debug_mode") or config.get("debug_mode"):
+                print("[DEBUG] Config file changed, applying")
+            self.apply_config(config)
+
+    def apply_config(self, config):
+        # Takes effect without a restart or a re-poll. The status socket, metrics port, history
+        # store, HID worker and profiler are set up once at startup and keep their settings until the next start.
+        old, self.config = self.config, config
+        metrics.enabled = config.get("metrics_enabled", False)
+        self.timers.tolerance = config.get("timer_tolerance", 5)
+        self.discovery.rescan_interval = config.get("discovery_rescan_interval", 900)
+        if old.get("autostart") != config.get("autostart"):
+            self.setup_autostart()
+        self.retime_pending = True
+        self.wake()
+        # Colors and icon style changed, not the devices; everyone redraws
+        self.publish_status(force=True)
+
+    def wake(self, poll=False):
+        # poll=True makes the monitor thread poll every device; otherwise it only re-reads its schedule
+        if poll:
+            self.poll_requested = True
+        self.update_event.set()
 
     def setup_autostart(self):
+        if winreg is None:
+            return
         try:
             key_path = r"SOFTWARE\Microsoft\Windows\CurrentVersion\Run"
             app_name = "BatteryMonitor"
@@ -107,255 +2112,673 @@ class BatteryMonitor:
         except Exception as e:
             print(f"Error setting up autostart: {e}")
 
-    def find_steelseries_headphones(self) -> Optional[dict]:
-        try:
-            devices = hid.enumerate(STEELSERIES_VID)
-            if self.config.get("debug_mode"):
-                print(f"[DEBUG] HID enumerate found {len(devices)} SteelSeries devices")
-            for device in devices:
-                for model in STEELSERIES_HEADPHONES:
-                    if device['product_id'] == model['product_id']:
-                        if self.config.get("debug_mode"):
-                            print(f"[DEBUG] Checking headphone: {model['name']} (PID: {hex(model['product_id'])})")
-                        idx = model.get('connected_status_idx')
-                        if idx is not None:
-                            try:
-                                d = hid.device()
-                                d.open(STEELSERIES_VID, model['product_id'])
-                                d.write(model['write_bytes'])
-                                resp = d.read(model['read_buf_size'])
-                                d.close()
-                                if not resp or resp[idx] == 0:
-                                    continue
-                            except Exception:
-                                continue
-                        if self.config.get("debug_mode"):
-                            print(f"Found headphone: {model['name']}")
-                        return model
-        except Exception as e:
-            if self.config.get("debug_mode"):
-                print(f"Error finding headphones: {e}")
-        return None
+    def close_hid_sessions(self):
+        for state in self.devices.values():
+            state.close()
 
-    def get_headphone_battery(self, model: dict) -> Tuple[Optional[int], None]:
-        try:
-            d = hid.device()
-            d.open(STEELSERIES_VID, model['product_id'])
-            d.write(model['write_bytes'])
-            resp = d.read(model['read_buf_size'])
-            d.close()
-            if self.config.get("debug_mode"):
-                print(f"[DEBUG] Headphone raw response: {list(resp) if resp else resp}")
-            if not resp:
-                return None, None
-            idx = model['battery_percent_idx']
-            raw = resp[idx]
-            rng = model['battery_range']
-            if rng == (0x00, 0x04):
-                percent = int((raw / 4.0) * 100)
-            elif rng == (0x64, 0xa5):
-                percent = int(((raw - 100) / 65.0) * 100)
-            elif rng == (0x00, 0x64):
-                percent = raw
+    def on_hotplug(self, action, path=None):
+        metrics.count("hotplug_events")
+        if self.config.get("debug_mode"):
+            print(f"[DEBUG] Hotplug {action}: {path}")
+        self.wake(poll=True)
+
+    def find_steelseries_headphones(self, entries=None) -> list:
+        # One (device_id, model, path) per physical headset dongle. Without an interface in the model,
+        # enumeration lists every interface of a dongle; the serial number tells dongles apart, and
+        # without one the dongle is opened by VID/PID like hidapi's open() does.
+        if entries is None:
+            entries = self.discovery.enumerate()
+        found = {}
+        for entry in entries:
+            model = self.registry.lookup(entry['vendor_id'], entry['product_id'], entry.get('interface_number'))
+            if model is None:
+                continue
+            if model.interface_number is not None:
+                device_id = f"{model.vendor_id:04x}:{model.product_id:04x}:{entry['path']!r}"
+                path = entry['path']
+            elif entry.get('serial_number'):
+                device_id = f"{model.vendor_id:04x}:{model.product_id:04x}:{entry['serial_number']}"
+                path = entry['path']
             else:
-                percent = raw
-            percent = max(0, min(100, percent))
-            return percent, None
-        except Exception as e:
-            if self.config.get("debug_mode"):
-                print(f"Error getting headphone battery: {e}")
-            return None, None
+                device_id = f"{model.vendor_id:04x}:{model.product_id:04x}"
+                path = None
+            if device_id not in found:
+                found[device_id] = (device_id, model, path)
+        return list(found.values())
 
-    def find_steelseries_mouse(self):
-        for attempt in range(3):
-            try:
-                mouse = rivalcfg.get_first_mouse()
-                if mouse and mouse.name:
-                    name = mouse.name.lower()
-                    if any(s in name for s in ['aerox', 'prime']):
-                        if self.config.get("debug_mode"):
-                            print(f"Found mouse: {mouse.name} (attempt {attempt+1})")
-                        return mouse
-                    elif self.config.get("debug_mode"):
-                        print(f"Mouse found but not Aerox/Prime: {mouse.name}")
-                elif self.config.get("debug_mode"):
-                    print(f"No mouse found by rivalcfg (attempt {attempt+1})")
-            except Exception as e:
+    def find_steelseries_mice(self, entries=None) -> list:
+        # Matched against rivalcfg's profiles from the cached HID table, no rivalcfg bus scan needed
+        if entries is None:
+            entries = self.discovery.enumerate()
+        found = {}
+        with metrics.phase("rivalcfg_discovery"):
+            for entry in entries:
+                device_id = f"{entry['vendor_id']:04x}:{entry['product_id']:04x}"
+                if device_id in found or self.registry.lookup(entry['vendor_id'], entry['product_id'], entry.get('interface_number')):
+                    continue
+                try:
+                    profile = rivalcfg.devices.get_profile(vendor_id=entry['vendor_id'], product_id=entry['product_id'])
+                except Exception:
+                    continue
+                name = profile.get("name", "Mouse")
+                if "battery_level_query" in profile or any(s in name.lower() for s in ['aerox', 'prime']):
+                    found[device_id] = (device_id, MouseDescriptor(
+                        name, entry['vendor_id'], entry['product_id'], profile, profile.get("endpoint")))
+        return list(found.values())
+
+    def sync_devices(self) -> list:
+        # Rebuilds the device table only when discovery saw the HID table change; returns the new ids
+        entries = self.discovery.enumerate()
+        if self.synced_generation == self.discovery.generation:
+            return []
+        self.synced_generation = self.discovery.generation
+        if self.config.get("debug_mode"):
+            print(f"[DEBUG] HID enumerate found {len(entries)} SteelSeries devices")
+        present = {}
+        for device_id, model, path in self.find_steelseries_headphones(entries):
+            present["headphone:" + device_id] = ("headphone", model, path)
+        for device_id, model in self.find_steelseries_mice(entries):
+            present["mouse:" + device_id] = ("mouse", model, None)
+        # Copy-on-write: the tray and settings threads iterate self.devices without a lock, so the table
+        # they hold is never changed, a new one replaces it
+        devices = dict(self.devices)
+        added = []
+        removed = [devices.pop(device_id) for device_id in list(devices) if device_id not in present]
+        for device_id, (kind, model, path) in present.items():
+            state = devices.get(device_id)
+            if state is not None and state.path != path:
+                state.close()
+                state.path = path
+            elif state is None:
                 if self.config.get("debug_mode"):
-                    print(f"Error finding mouse (attempt {attempt+1}): {e}")
-            time.sleep(0.2)
-        return None
+                    print(f"Found {kind}: {model.name}")
+                devices[device_id] = DeviceState(device_id, kind, model, path)
+                added.append(device_id)
+        self.devices = devices
+        for state in removed:
+            state.close()
+            self.scheduler.unschedule(state.id)
+        return added
 
-    def get_mouse_battery(self, mouse, retries=6) -> Tuple[Optional[int], Optional[bool]]:
-        for attempt in range(retries):
-            try:
+    def get_headphone_battery(self, model: HeadphoneModel, report) -> Tuple[Optional[int], Optional[bool]]:
+        if self.config.get("debug_mode"):
+            print(f"[DEBUG] Headphone raw response: {bytes(report).hex(' ') if report else report}")
+        if not report:
+            return None, None
+        with metrics.phase("decode"):
+            return model.decode(memoryview(report))
+
+    def open_mouse(self, state):
+        # Opened straight from the cached VID/PID; the handle stays open from one poll to the next
+        if state.session is None:
+            model = state.model
+            with metrics.phase("mouse_open"):
+                state.session = rivalcfg.mouse.get_mouse(vendor_id=model.vendor_id, product_id=model.product_id)
+        return state.session
+
+    def get_mouse_battery(self, mouse, reads=2) -> Tuple[Optional[int], Optional[bool]]:
+        # A sleeping mouse answers without a level; it gets one more read, not a retry loop
+        for attempt in range(reads):
+            with metrics.phase("mouse_battery_read"):
                 battery = mouse.battery
-                if self.config.get("debug_mode"):
-                    print(f"Mouse battery info (attempt {attempt+1}): {battery}")
-                if battery and battery.get("level") is not None:
-                    level = max(0, min(100, battery["level"]))
-                    charging = battery.get("is_charging", False)
-                    return level, charging
+            if self.config.get("debug_mode"):
+                print(f"Mouse battery info (attempt {attempt+1}): {battery}")
+            if battery and battery.get("level") is not None:
+                level = max(0, min(100, battery["level"]))
+                charging = battery.get("is_charging", False)
+                return level, charging
+            metrics.count("mouse_battery_retries")
+        return None, None
+
+    def poll_mouse(self, state):
+        level = charging = None
+        # One reopen: a stale handle (receiver replugged, mouse re-paired) fails on the first read
+        for attempt in range(2):
+            try:
+                level, charging = self.get_mouse_battery(self.open_mouse(state))
+                break
             except Exception as e:
+                metrics.count("mouse_errors")
+                state.close()
                 if self.config.get("debug_mode"):
-                    print(f"Error getting mouse battery (attempt {attempt+1}): {e}")
-            time.sleep(0.2)
-        return None, None
+                    print(f"Error reading mouse {state.model.name} (attempt {attempt+1}): {e}")
+        else:
+            # Gone for good: let the next cycle rescan instead of reopening a device that is not there
+            self.discovery.invalidate()
+        self.record_poll(state, level, charging)
 
-    def update_device_status(self):
-        mouse = self.find_steelseries_mouse()
-        if mouse:
-            level, charging = self.get_mouse_battery(mouse)
-            if level is not None:
-                self.mouse_status = DeviceStatus(mouse.name, level, charging, True)
-                self.mouse_fail_count = 0
-            else:
-                self.mouse_fail_count += 1
-            mouse.close()
+    def poll_headphone(self, state):
+        model = state.model
+        level = charging = None
+        try:
+            if state.session is None:
+                state.session = HidSession(model.vendor_id, model.product_id, state.path)
+            report = state.session.query(model.write_bytes, model.read_buf_size, self.config.get("hid_timeout_ms", 1000))
+            level, charging = self.get_headphone_battery(model, report)
+        except HidTimeout as e:
+            if self.config.get("debug_mode"):
+                print(f"Headphone did not answer: {e}")
+            self.record_poll(state, None, None, degraded=True)
+            return
+        except Exception as e:
+            self.discovery.invalidate()
+            if self.config.get("debug_mode"):
+                print(f"Error getting headphone battery: {e}")
+        if level is not None:
+            self.last_headphone_battery = level
+        self.record_poll(state, level, charging)
+
+    def record_poll(self, state, level, charging, degraded=False):
+        # A degraded device is still there but not answering; it keeps its last reading until it counts as gone
+        if level is not None:
+            state.status = DeviceStatus(state.model.name, level, charging, True)
+            state.fail_count = 0
         else:
-            self.mouse_fail_count += 1
-        if self.mouse_fail_count >= 3:
-            self.mouse_status = DeviceStatus("Mouse", is_connected=False)
-
-        headphone_model = self.find_steelseries_headphones()
-        if headphone_model:
-            level, _ = self.get_headphone_battery(headphone_model)
-            if level is not None:
-                self.headphone_status = DeviceStatus(headphone_model['name'], level, None, True)
-                self.last_headphone_battery = level
-                self.headphone_fail_count = 0
-            else:
-                self.headphone_fail_count += 1
+            state.fail_count += 1
+            if state.fail_count >= 3:
+                state.status = DeviceStatus(state.model.name, is_connected=False)
+            elif degraded and state.status.is_connected:
+                state.status = replace(state.status, is_degraded=True)
+
+    def on_poll_timeout(self, device_id):
+        state = self.devices.get(device_id)
+        if state is None:
+            return
+        metrics.count(f"{state.kind}_poll_timeouts")
+        if self.config.get("debug_mode"):
+            print(f"[DEBUG] {state.model.name} poll missed its deadline")
+        self.record_poll(state, None, None, degraded=True)
+
+    def devices_of(self, kind) -> list:
+        return [state for state in self.devices.values() if state.kind == kind]
+
+    def primary_device(self, kind) -> Optional[DeviceState]:
+        # The device that speaks for its kind in the icon and settings: the emptiest connected one
+        states = self.devices_of(kind)
+        readings = [s for s in states if s.status.is_connected and s.status.battery_level is not None]
+        if readings:
+            return min(readings, key=lambda s: s.status.battery_level)
+        return states[0] if states else None
+
+    def primary_status(self, kind) -> DeviceStatus:
+        state = self.primary_device(kind)
+        if state is None:
+            return DeviceStatus("Mouse" if kind == "mouse" else "Headphones")
+        return state.status
+
+    @property
+    def mouse_status(self) -> DeviceStatus:
+        return self.primary_status("mouse")
+
+    @property
+    def headphone_status(self) -> DeviceStatus:
+        return self.primary_status("headphone")
+
+    def update_device_status(self, on_update=None, device_ids=None) -> list:
+        # Devices are polled in parallel, each result is handed to on_update as soon as it is ready.
+        # A poll that misses its deadline counts as a failure and is left running; it is not resubmitted until it returns.
+        added = self.sync_devices()
+        if device_ids is None:
+            device_ids = list(self.devices)
         else:
-            self.headphone_fail_count += 1
-        if self.headphone_fail_count >= 3:
-            self.headphone_status = DeviceStatus("Headphones", is_connected=False)
+            device_ids = [d for d in device_ids if d in self.devices] + [d for d in added if d not in device_ids]
+        self.poll_pool.resize(min(self.config.get("max_poll_workers", 32), max(4, len(device_ids))))
+        deadlines = self.config.get("poll_deadlines", DEFAULT_CONFIG["poll_deadlines"])
+        start = time.monotonic()
+        pending = {}
+        for device_id in device_ids:
+            state = self.devices[device_id]
+            future = state.inflight
+            if future is None or future.done():
+                poll = self.poll_mouse if state.kind == "mouse" else self.poll_headphone
+                task = lambda poll=poll, state=state: poll(state)
+                if self.profiler is not None:
+                    task = self.profiler.wrap(task)
+                future = state.inflight = self.poll_pool.submit(task)
+            pending[future] = (device_id, start + deadlines.get(state.kind, DEFAULT_CONFIG["poll_deadlines"][state.kind]))
+        while pending:
+            timeout = max(0, min(deadline for _, deadline in pending.values()) - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for future in list(pending):
+                device_id, deadline = pending[future]
+                if future in done:
+                    del pending[future]
+                    if future.exception() is not None and self.config.get("debug_mode"):
+                        print(f"Error polling {device_id}: {future.exception()}")
+                elif now >= deadline:
+                    del pending[future]
+                    # Still queued behind other polls: drop it rather than let it run late
+                    future.cancel()
+                    self.on_poll_timeout(device_id)
+                else:
+                    continue
+                if on_update:
+                    on_update(device_id)
+        return device_ids
 
     def get_battery_color(self, level, is_charging):
         if level is None:
             return self.config["colors"]["error"]
         if is_charging:
             return self.config["colors"]["charging"]
-        if level < 20:
+        if level < LOW_BATTERY:
             return self.config["colors"]["low"]
         elif level < 50:
             return self.config["colors"]["medium"]
         return self.config["colors"]["high"]
 
-    def create_icon(self):
-        icon_style = self.config.get("icon_style", "split")
+    def icon_key(self):
+        # Everything that is visible in the icon: bar heights and colors per shown kind, each bar showing its emptiest device
+        style = self.config.get("icon_style", "split")
+        kinds = {"split": DEVICE_KINDS, "mouse_only": ("mouse",), "headphone_only": ("headphone",)}.get(style, ())
+        slots = []
+        for kind in kinds:
+            status = self.primary_status(kind)
+            if status.is_connected and status.battery_level is not None:
+                height = int((status.battery_level / 100.0) * 60)
+                slots.append((height, self.get_battery_color(status.battery_level, status.is_charging)))
+            else:
+                slots.append((None, self.config["colors"]["error"]))
+        return style, tuple(slots)
+
+    @staticmethod
+    def render_icon(key):
+        style, slots = key
         image = Image.new("RGBA", (64, 64), color=(0, 0, 0, 0))
         draw = ImageDraw.Draw(image)
-        if icon_style == "split":
-            if self.mouse_status.is_connected and self.mouse_status.battery_level is not None:
-                mouse_color = self.get_battery_color(self.mouse_status.battery_level, self.mouse_status.is_charging)
-                mouse_height = int((self.mouse_status.battery_level / 100.0) * 60)
-                draw.rectangle([2, 62 - mouse_height, 30, 62], fill=mouse_color)
-            else:
-                draw.rectangle([2, 2, 30, 62], fill=self.config["colors"]["error"])
-            if self.headphone_status.is_connected and self.headphone_status.battery_level is not None:
-                hp_color = self.get_battery_color(self.headphone_status.battery_level, self.headphone_status.is_charging)
-                hp_height = int((self.headphone_status.battery_level / 100.0) * 60)
-                draw.rectangle([34, 62 - hp_height, 62, 62], fill=hp_color)
+        columns = [(2, 30), (34, 62)] if style == "split" else [(2, 62)]
+        for (left, right), (height, color) in zip(columns, slots):
+            if height is None:
+                draw.rectangle([left, 2, right, 62], fill=color)
             else:
-                draw.rectangle([34, 2, 62, 62], fill=self.config["colors"]["error"])
+                draw.rectangle([left, 62 - height, right, 62], fill=color)
+        if style == "split":
             draw.line([32, 2, 32, 62], fill="white", width=2)
-        elif icon_style == "mouse_only":
-            if self.mouse_status.is_connected and self.mouse_status.battery_level is not None:
-                color = self.get_battery_color(self.mouse_status.battery_level, self.mouse_status.is_charging)
-                height = int((self.mouse_status.battery_level / 100.0) * 60)
-                draw.rectangle([2, 62 - height, 62, 62], fill=color)
-            else:
-                draw.rectangle([2, 2, 62, 62], fill=self.config["colors"]["error"])
-        elif icon_style == "headphone_only":
-            if self.headphone_status.is_connected and self.headphone_status.battery_level is not None:
-                color = self.get_battery_color(self.headphone_status.battery_level, self.headphone_status.is_charging)
-                height = int((self.headphone_status.battery_level / 100.0) * 60)
-                draw.rectangle([2, 62 - height, 62, 62], fill=color)
-            else:
-                draw.rectangle([2, 2, 62, 62], fill=self.config["colors"]["error"])
         draw.rectangle([0, 0, 63, 63], outline="white", width=2)
         return image
 
-    def create_menu(self):
-        menu_items = []
-        if self.mouse_status.is_connected:
-            mouse_text = f"🖱️ {self.mouse_status.name}"
-            if self.mouse_status.battery_level is not None:
-                mouse_text += f" - {self.mouse_status.battery_level}%"
-                if self.mouse_status.is_charging:
-                    mouse_text += " (Charging)"
-            menu_items.append(pystray.MenuItem(mouse_text, lambda: None, enabled=False))
-        else:
-            menu_items.append(pystray.MenuItem("🖱️ Mouse - Not Connected", lambda: None, enabled=False))
-        if self.headphone_status.is_connected:
-            hp_text = f"🎧 {self.headphone_status.name}"
-            if self.headphone_status.battery_level is not None:
-                hp_text += f" - {self.headphone_status.battery_level}%"
-            menu_items.append(pystray.MenuItem(hp_text, lambda: None, enabled=False))
-        else:
-            menu_items.append(pystray.MenuItem("🎧 Headphones - Not Connected", lambda: None, enabled=False))
+    def create_icon(self):
+        return self.icon_cache.get(self.icon_key())
+
+    def device_text(self, state) -> str:
+        icon = "🖱️" if state.kind == "mouse" else "🎧"
+        status = state.status
+        if not status.is_connected:
+            return f"{icon} {status.name} - Not Connected"
+        text = f"{icon} {status.name}"
+        if status.battery_level is not None:
+            text += f" - {status.battery_level}%"
+            left = self.time_left(state.id)
+            if status.is_degraded:
+                text += " (Not responding)"
+            elif status.is_charging:
+                text += " (Charging)"
+            elif left:
+                text += f" (~{left} left)"
+        return text
+
+    def menu_key(self):
+        lines = []
+        limit = self.config.get("menu_device_limit", 12)
+        for kind in DEVICE_KINDS:
+            states = self.devices_of(kind)
+            if not states:
+                lines.append("🖱️ Mouse - Not Connected" if kind == "mouse" else "🎧 Headphones - Not Connected")
+                continue
+            # Past the limit the emptiest devices are listed and the rest are summed up in one line
+            if len(states) > limit:
+                states.sort(key=lambda s: (not s.status.is_connected, s.status.battery_level if s.status.battery_level is not None else 101))
+                rest = states[limit - 1:]
+                states = states[:limit - 1]
+                low = sum(1 for s in rest if s.status.battery_level is not None and s.status.battery_level < LOW_BATTERY)
+                offline = sum(1 for s in rest if not s.status.is_connected)
+                summary = f"… {len(rest)} more"
+                if low or offline:
+                    summary += f" ({low} low, {offline} offline)"
+            else:
+                summary = None
+            lines.extend(self.device_text(state) for state in states)
+            if summary:
+                lines.append(summary)
+        return tuple(lines)
+
+    def render_menu(self, key):
+        menu_items = [pystray.MenuItem(text, lambda: None, enabled=False) for text in key]
         menu_items.append(pystray.MenuItem("", lambda: None))
         menu_items.extend([
             pystray.MenuItem("🔄 Refresh", self.force_update),
             pystray.MenuItem("⚙️ Settings", self.open_settings),
-            pystray.MenuItem("❌ Quit", self.quit_app)
         ])
+        if self.profiler is not None:
+            menu_items.append(pystray.MenuItem("📊 Profile next cycle", self.profile_cycle))
+        menu_items.append(pystray.MenuItem("❌ Quit", self.quit_app))
         return pystray.Menu(*menu_items)
 
+    def create_menu(self):
+        return self.menu_cache.get(self.menu_key())
+
+    def tooltip_text(self):
+        tooltip = []
+        for kind, label, plural in (("mouse", "Mouse", "Mice"), ("headphone", "Headphones", "Headsets")):
+            readings = [s for s in self.devices_of(kind) if s.status.is_connected and s.status.battery_level is not None]
+            if len(readings) == 1:
+                text = f"{label}: {readings[0].status.battery_level}%"
+                left = self.time_left(readings[0].id)
+                if left:
+                    text += f" (~{left})"
+                tooltip.append(text)
+            elif readings:
+                lowest = min(s.status.battery_level for s in readings)
+                tooltip.append(f"{plural}: {len(readings)}, lowest {lowest}%")
+        return " | ".join(tooltip) if tooltip else "Battery Monitor - No devices"
+
     def force_update(self, icon=None, item=None):
-        for _ in range(6):
-            self.update_device_status()
-            time.sleep(0.1)
-        self.update_tray()
+        self.request_refresh(callback=self.on_refreshed)
+
+    def on_refreshed(self, future):
+        # Runs on the monitor thread; the tray worker shows the outcome as a notification
+        error = future.exception()
+        self.refresh_notice = f"Refresh failed: {error}" if error is not None else self.tooltip_text()
+        self.tray_worker.poke()
+
+    def request_refresh(self, callback=None) -> Future:
+        # Returns at once; the monitor thread does the polling. Requests made while a refresh is
+        # queued or running share it, and its future resolves to the status snapshot once it is done.
+        with self.refresh_lock:
+            future = self.refresh_running or self.refresh_pending
+            if future is None:
+                future = self.refresh_pending = Future()
+                self.wake(poll=True)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def start_refresh(self):
+        with self.refresh_lock:
+            self.refresh_running, self.refresh_pending = self.refresh_pending, None
+        if self.refresh_running is not None:
+            metrics.count("refreshes")
+            self.discovery.invalidate()
+
+    def finish_refresh(self, error=None):
+        with self.refresh_lock:
+            future, self.refresh_running = self.refresh_running, None
+        if future is None:
+            return
+        if error is None:
+            future.set_result(self.status_snapshot())
+        else:
+            future.set_exception(error)
 
     def open_settings(self, icon=None, item=None):
         def _show():
             if self.settings_window is None or not self.settings_window.window.winfo_exists():
                 self.settings_window = SettingsWindow(self)
-        root.after(0, _show)
+        ensure_tk_root().after(0, _show)
 
     def quit_app(self, icon=None, item=None):
         self.running = False
+        self.update_event.set()
+        self.timers.stop()
+        self.discovery.stop()
+        self.config_store.stop()
+        self.config_store.flush()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.status_server:
+            self.status_server.stop()
+        self.settings_window = None
+        if root is not None:
+            root.after(0, root.quit)
+        self.close_hid_sessions()
+        if self.hid_worker:
+            self.hid_worker.stop()
+        if self.history:
+            self.history.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.telemetry:
+            self.telemetry.stop()
+        self.tray_worker.stop()
         if self.tray_icon:
             self.tray_icon.stop()
 
     def update_tray(self):
+        # Each part is pushed only when its content changed, every assignment makes the OS redraw the tray
         if self.tray_icon:
-            self.tray_icon.icon = self.create_icon()
-            self.tray_icon.menu = self.create_menu()
-            tooltip = []
-            if self.mouse_status.is_connected and self.mouse_status.battery_level is not None:
-                tooltip.append(f"Mouse: {self.mouse_status.battery_level}%")
-            if self.headphone_status.is_connected and self.headphone_status.battery_level is not None:
-                tooltip.append(f"Headphones: {self.headphone_status.battery_level}%")
-            self.tray_icon.title = " | ".join(tooltip) if tooltip else "Battery Monitor - No devices"
-
-    def monitor_loop(self):
+            notice, self.refresh_notice = self.refresh_notice, None
+            if notice and getattr(self.tray_icon, "HAS_NOTIFICATION", False):
+                try:
+                    self.tray_icon.notify(notice, "Battery Monitor")
+                except Exception as e:
+                    if self.config.get("debug_mode"):
+                        print(f"Error showing notification: {e}")
+            icon_key = self.icon_key()
+            if icon_key != self.tray_state.get("icon"):
+                icon = self.icon_cache.get(icon_key)
+                with metrics.phase("tray_push"):
+                    self.tray_icon.icon = icon
+                self.tray_state["icon"] = icon_key
+            menu_key = self.menu_key()
+            if menu_key != self.tray_state.get("menu"):
+                menu = self.menu_cache.get(menu_key)
+                with metrics.phase("tray_push"):
+                    self.tray_icon.menu = menu
+                self.tray_state["menu"] = menu_key
+            title = self.tooltip_text()
+            if title != self.tray_state.get("title"):
+                with metrics.phase("tray_push"):
+                    self.tray_icon.title = title
+                self.tray_state["title"] = title
+
+    def record_reading(self, device_id):
+        # Only fresh readings, a failed poll leaves the previous status in place
+        state = self.devices.get(device_id)
+        if state is None or state.fail_count:
+            return
+        status = state.status
+        state.estimator.update(time.monotonic(), status.battery_level, status.is_charging, state.model.step)
+        if self.history is not None:
+            try:
+                serial = device_id.split(":")[3] if device_id.count(":") >= 3 else ""
+                self.history.record(state.kind, status, name=f"{status.name} {serial}".strip())
+            except Exception as e:
+                # Shown once per distinct error, an unwritable directory would otherwise repeat every cycle
+                if str(e) != self.history_error or self.config.get("debug_mode"):
+                    self.history_error = str(e)
+                    print(f"Error recording history: {e}")
+
+    def time_left(self, device_id) -> Optional[str]:
+        state = self.devices.get(device_id)
+        if state is None:
+            return None
+        status = state.status
+        if not status.is_connected or status.battery_level is None or status.is_charging:
+            return None
+        seconds = state.estimator.time_to_empty(time.monotonic())
+        return None if seconds is None else format_duration(seconds)
+
+    def on_device_polled(self, device_id):
+        self.record_reading(device_id)
+        self.publish_status()
+
+    def publish_status(self, force=False):
+        statuses = {device_id: (state.status, self.time_left(device_id)) for device_id, state in list(self.devices.items())}
+        self.status_bus.publish(statuses, force)
+
+    def status_snapshot(self) -> dict:
+        devices = {}
+        for device_id, state in list(self.devices.items()):
+            devices[device_id] = asdict(state.status)
+            devices[device_id]["kind"] = state.kind
+            devices[device_id]["time_left"] = self.time_left(device_id)
+        return {"timestamp": time.time(), "devices": devices, "wakeups_per_hour": round(self.timers.wakeups_per_hour(), 1)}
+
+    def poll_interval(self, state) -> float:
+        base = self.config.get("update_interval", 300)
+        if not self.config.get("adaptive_polling", True):
+            return base
+        return self.scheduler.interval_for(
+            state.id, state.status, base,
+            self.config.get("min_poll_interval", 30),
+            self.config.get("max_poll_interval", 3600),
+        )
+
+    def reschedule(self, device_ids):
+        now = time.monotonic()
+        for device_id in device_ids:
+            state = self.devices.get(device_id)
+            if state is None:
+                continue
+            self.scheduler.observe(device_id, state.status, now)
+            state.polled_at = now
+            interval = self.poll_interval(state)
+            if self.config.get("debug_mode"):
+                print(f"[DEBUG] Next {state.model.name} poll in {interval:.0f}s")
+            self.scheduler.schedule(device_id, now + interval)
+
+    def retime(self):
+        # After a config change: the new interval counts from each device's last poll
+        now = time.monotonic()
+        for state in list(self.devices.values()):
+            if state.polled_at is not None and state.id in self.scheduler.due:
+                self.scheduler.schedule(state.id, max(now, state.polled_at + self.poll_interval(state)))
+
+    def poll_cycle(self, device_ids=None):
+        if self.profiler is not None:
+            self.profiler.run(self.run_cycle, device_ids, device_handles=self.device_handles)
+        else:
+            self.run_cycle(device_ids)
+
+    def run_cycle(self, device_ids=None):
+        if self.recorder is not None:
+            self.recorder.write(HidRecorder.CYCLE, payload=json.dumps(device_ids).encode())
+        with metrics.phase("cycle"):
+            polled = self.update_device_status(on_update=self.on_device_polled, device_ids=device_ids)
+            self.reschedule(polled)
+            # Unplugged devices are dropped without a poll, so nothing else would take them off the tray
+            self.publish_status()
+        metrics.count("cycles")
+        self.export_metrics()
+
+    def device_handles(self) -> int:
+        return sum(1 for state in list(self.devices.values()) if state.session is not None)
+
+    def profile_cycle(self, icon=None, item=None) -> dict:
+        # cProfile the next cycle, which is started right away
+        if self.profiler is None:
+            return {"error": "profiling is off, set profile_cycles in the config"}
+        self.profiler.request_profile()
+        self.wake(poll=True)
+        return {"ok": True, "dir": self.profiler.output_dir}
+
+    def export_metrics(self):
+        path = self.config.get("metrics_file")
+        if metrics.enabled and path:
+            try:
+                metrics.write_textfile(path)
+            except Exception as e:
+                if self.config.get("debug_mode"):
+                    print(f"Error writing metrics: {e}")
+
+    def monitor_loop(self, initial_poll=True):
+        # Sleeps on update_event only; the next poll, like every other deadline, is a timer in self.timers.
+        # Without initial_poll (the caller already polled) the first pass only arms the timer.
+        self.wake(poll=initial_poll)
         while self.running:
             try:
-                self.update_device_status()
-                self.update_tray()
-                interval = self.config.get("update_interval", 300)
-                if self.update_event.wait(timeout=interval):
-                    self.update_event.clear()
+                self.update_event.wait()
+                self.update_event.clear()
+                if not self.running:
+                    break
+                if self.retime_pending:
+                    self.retime_pending = False
+                    self.retime()
+                if self.poll_requested:
+                    self.poll_requested = False
+                    self.start_refresh()
+                    self.poll_cycle()
+                    self.finish_refresh()
+                else:
+                    # Devices due within the tolerance are polled together rather than one wakeup each
+                    horizon = time.monotonic() + self.timers.tolerance
+                    due = self.scheduler.pop_due(horizon)
+                    # A due rescan runs as a cycle too, even with nothing to poll, so a device plugged in
+                    # with no hotplug events (Windows, macOS, or an empty table) is found and polled
+                    if due or self.discovery.next_scan() <= horizon:
+                        self.poll_cycle(due)
+                next_due = self.scheduler.next_due()
+                next_scan = self.discovery.next_scan()
+                self.arm_poll_timer(next_scan if next_due is None else min(next_due, next_scan))
             except Exception as e:
+                self.finish_refresh(e)
                 if self.config.get("debug_mode"):
                     print(f"Error in monitor loop: {e}")
-                time.sleep(5)
+                self.arm_poll_timer(time.monotonic() + 5)
+
+    def arm_poll_timer(self, when):
+        if self.poll_timer is not None:
+            self.poll_timer.cancel()
+        self.poll_timer = None if when is None else self.timers.call_at(when, self.update_event.set)
+        metrics.gauge("timer_wakeups_per_hour", round(self.timers.wakeups_per_hour(), 1))
+
+    def start_services(self):
+        self.timers.start()
+        self.discovery.start()
+        self.config_store.start()
+        if self.config.get("telemetry_url"):
+            self.telemetry = TelemetryExporter(
+                self.config["telemetry_url"],
+                self.config.get("telemetry_spool_dir") or os.path.join(os.path.dirname(self.config_store.path), "spool"),
+                self.config.get("telemetry_agent") or socket.gethostname(),
+                self.config.get("telemetry_interval", 60),
+                timers=self.timers,
+            )
+            self.status_bus.subscribe(self.telemetry.on_status_changed)
+            self.telemetry.start()
+        port = self.config.get("metrics_port")
+        if metrics.enabled and port:
+            try:
+                self.metrics_server = MetricsServer(metrics, port)
+                self.metrics_server.start()
+            except Exception as e:
+                print(f"Error starting metrics server: {e}")
+
+    def run_headless(self, socket_path=None):
+        # Polling core only: no Tk, no tray; consumers read cached snapshots over the status socket
+        self.start_services()
+        self.status_server = StatusServer(self, socket_path or self.config.get("ipc_socket") or default_socket_path())
+        self.status_server.start()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            if hasattr(signal, "SIGUSR1"):
+                signal.signal(signal.SIGUSR1, lambda signum, frame: self.profile_cycle())
+        try:
+            self.monitor_loop()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.quit_app()
 
     def run(self):
+        if self.config.get("autostart", True):
+            self.setup_autostart()
         time.sleep(1)
-        self.update_device_status()
-        icon_image = self.create_icon()
-        menu = self.create_menu()
+        self.poll_cycle()
+        # Seeded from the first poll: later polls with the same readings publish nothing to update it
+        self.tray_state = {"icon": self.icon_key(), "menu": self.menu_key(), "title": self.tooltip_text()}
         self.tray_icon = pystray.Icon(
             "BatteryMonitor",
-            icon=icon_image,
-            title="Battery Monitor",
-            menu=menu
+            icon=self.icon_cache.get(self.tray_state["icon"]),
+            title=self.tray_state["title"],
+            menu=self.menu_cache.get(self.tray_state["menu"])
         )
-        monitor_thread = threading.Thread(target=self.monitor_loop, daemon=True)
+        self.start_services()
+        # pystray is only touched from the tray worker, the monitor thread just pokes it
+        self.tray_worker.start()
+        self.status_bus.subscribe(lambda changes: self.tray_worker.poke())
+        monitor_thread = threading.Thread(target=self.monitor_loop, args=(False,), daemon=True)
         monitor_thread.start()
         self.tray_icon.run()
 
@@ -412,7 +2835,8 @@ class SettingsWindow:
         button_frame.grid(row=6, column=0, columnspan=2, pady=20)
         ttk.Button(button_frame, text="Cancel", command=self.on_close).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Apply", command=self.apply_settings).pack(side=tk.LEFT, padx=5)
-        self.update_device_status()
+        self.show_device_status()
+        self.unsubscribe = self.monitor.status_bus.subscribe(self.on_status_changed)
 
     def load_current_settings(self):
         config = self.monitor.config
@@ -437,27 +2861,33 @@ class SettingsWindow:
 
     def apply_settings(self):
         try:
+            config = copy.deepcopy(self.monitor.config)
             interval_map = {"1 minute": 60, "5 minutes": 300, "10 minutes": 600, "30 minutes": 1800, "1 hour": 3600}
-            self.monitor.config["update_interval"] = interval_map.get(self.interval_var.get(), 300)
+            config["update_interval"] = interval_map.get(self.interval_var.get(), 300)
             style_map = {"Split View": "split", "Mouse Only": "mouse_only", "Headphones Only": "headphone_only"}
-            self.monitor.config["icon_style"] = style_map.get(self.icon_style_var.get(), "split")
-            self.monitor.config["autostart"] = self.autostart_var.get()
-            self.monitor.config["debug_mode"] = self.debug_var.get()
+            config["icon_style"] = style_map.get(self.icon_style_var.get(), "split")
+            config["autostart"] = self.autostart_var.get()
+            config["debug_mode"] = self.debug_var.get()
             for key, button in self.color_vars.items():
-                self.monitor.config["colors"][key] = button.cget("bg")
-            self.monitor.setup_autostart()
-            self.monitor.force_update()
-            self.monitor.save_config()
+                config["colors"][key] = button.cget("bg")
+            self.monitor.update_config(config)
             messagebox.showinfo("Settings", "Settings applied successfully!", parent=self.window)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to apply settings: {e}", parent=self.window)
 
     def save_settings(self):
         self.apply_settings()
-        self.monitor.save_config()
+        self.monitor.config_store.flush()
         self.on_close()
 
-    def update_device_status(self):
+    def on_status_changed(self, changes):
+        # Called on the monitor thread; the labels are only touched from Tk's
+        try:
+            self.window.after(0, self.show_device_status)
+        except (RuntimeError, tk.TclError):
+            pass
+
+    def show_device_status(self):
         if self.monitor.mouse_status.is_connected:
             mouse_text = f"Mouse Connected: {self.monitor.mouse_status.name}"
             if self.monitor.mouse_status.battery_level is not None:
@@ -466,6 +2896,10 @@ class SettingsWindow:
                     mouse_text += " - Charging"
                 else:
                     mouse_text += " - Discharging"
+                    state = self.monitor.primary_device("mouse")
+                    left = self.monitor.time_left(state.id) if state else None
+                    if left:
+                        mouse_text += f", about {left} left"
         else:
             mouse_text = "Mouse: Not Connected"
         self.mouse_status_label.config(text=mouse_text)
@@ -473,18 +2907,80 @@ class SettingsWindow:
             hp_text = f"Headphones Connected: {self.monitor.headphone_status.name}"
             if self.monitor.headphone_status.battery_level is not None:
                 hp_text += f" ({self.monitor.headphone_status.battery_level}%)"
+                state = self.monitor.primary_device("headphone")
+                left = self.monitor.time_left(state.id) if state else None
+                if left:
+                    hp_text += f" - about {left} left"
         else:
             hp_text = "Headphones: Not Connected"
         self.headphone_status_label.config(text=hp_text)
-        self.window.after(2000, self.update_device_status)
 
     def on_close(self):
+        self.unsubscribe()
         if self.window:
             self.window.destroy()
         self.monitor.settings_window = None
 
-if __name__ == "__main__":
+def print_status(snapshot, as_json):
+    if as_json:
+        print(json.dumps(snapshot))
+        return
+    for status in snapshot["devices"].values():
+        if not status["is_connected"]:
+            print(f"{status['kind']}: {status['name']} not connected")
+            continue
+        line = f"{status['kind']}: {status['name']} {status['battery_level']}%"
+        if status["is_degraded"]:
+            line += " (not responding)"
+        elif status["is_charging"]:
+            line += " (charging)"
+        elif status["time_left"]:
+            line += f" (~{status['time_left']} left)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="SteelSeries battery monitor")
+    parser.add_argument("--headless", action="store_true", help="poll without tray or GUI and serve status over a local socket")
+    parser.add_argument("--once", action="store_true", help="print the current status and exit")
+    parser.add_argument("--json", action="store_true", help="with --once, print JSON")
+    parser.add_argument("--socket", help="status socket path")
+    parser.add_argument("--record", metavar="FILE", help="append all HID and rivalcfg traffic to FILE (replay with bench/replay.py)")
+    parser.add_argument("--profile-cycle", action="store_true", help="ask the running headless instance to cProfile its next poll cycle")
+    args = parser.parse_args()
+
+    if args.profile_cycle:
+        try:
+            reply = query_status(args.socket or default_socket_path(), "profile")
+        except (OSError, ValueError, AttributeError) as e:
+            sys.exit(f"No running instance: {e}")
+        print(reply.get("error") or f"Profiling the next cycle, stats go to the agent's output and {reply['dir']}")
+        return
+
+    if args.once:
+        monitor = None
+        try:
+            snapshot = query_status(args.socket or default_socket_path())
+        except (OSError, ValueError, AttributeError):
+            # No daemon running, read the hardware directly
+            monitor = BatteryMonitor()
+            if args.record:
+                monitor.start_recording(args.record)
+            monitor.poll_cycle()
+            snapshot = monitor.status_snapshot()
+        print_status(snapshot, args.json)
+        if monitor is not None:
+            monitor.quit_app()
+        return
     monitor = BatteryMonitor()
-    tray_thread = threading.Thread(target=monitor.run, daemon=True)
-    tray_thread.start()
-    root.mainloop()
\ No newline at end of file
+    if args.record:
+        monitor.start_recording(args.record)
+    if args.headless:
+        monitor.run_headless(args.socket)
+        return
+
+    monitor.run()
+
+if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        multiprocessing.freeze_support()
+    main()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import time
+import zlib
+from urllib.parse import urlsplit, parse_qs
+
+MAX_BODY = 1 << 20
+MAX_INFLATED = 16 << 20
+IDLE_TIMEOUT = 120
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+class FleetIndex:
+    # Latest status per (agent, device). Connected devices are also filed under their level,
+    # so "below N%" reads N buckets instead of scanning the whole fleet.
+    def __init__(self):
+        self.devices = {}
+        self.levels = [set() for _ in range(101)]
+        self.offline = set()
+
+    def update(self, agent, record):
+        key = (agent, record["device_id"])
+        old = self.devices.get(key)
+        if old is not None:
+            # A batch that sat in the agent's spool must not overwrite a newer reading
+            if record.get("timestamp", 0) < old.get("timestamp", 0):
+                return
+            del self.devices[key]
+            self._bucket(old).discard(key)
+        if record.get("removed"):
+            return
+        self.devices[key] = record
+        self._bucket(record).add(key)
+
+    def _bucket(self, record) -> set:
+        level = record.get("battery_level")
+        if not record.get("is_connected") or level is None:
+            return self.offline
+        return self.levels[max(0, min(100, int(level)))]
+
+    def below(self, threshold) -> list:
+        keys = set().union(*self.levels[:max(0, min(101, threshold))])
+        return sorted((self.view(key) for key in keys), key=lambda d: d["battery_level"])
+
+    def view(self, key) -> dict:
+        return dict(self.devices[key], agent=key[0])
+
+    def summary(self) -> dict:
+        return {
+            "agents": len({agent for agent, _ in self.devices}),
+            "devices": len(self.devices),
+            "offline": len(self.offline),
+        }
+
+class Aggregator:
+    # Plain HTTP/1.1 with keep-alive on asyncio streams, one coroutine per agent connection.
+    #   POST /ingest           {"agent": ..., "records": [...]}, optionally deflated (Content-Encoding: deflate)
+    #   GET  /below?level=20   connected devices under 20%, emptiest first
+    #   GET  /devices          everything, GET /health counts
+    def __init__(self):
+        self.index = FleetIndex()
+        self.batches = 0
+        self.records = 0
+        self.started = time.time()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not line:
+                    break
+                method, target, _ = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = self.route(method, target, headers, body)
+                close = headers.get("connection", "").lower() == "close"
+                await self.respond(writer, status, payload, close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, close=False):
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/ingest":
+            if method != "POST":
+                return 405, {"error": "POST only"}
+            try:
+                return 200, {"accepted": self.ingest(body, headers.get("content-encoding", ""))}
+            except (ValueError, KeyError, TypeError, zlib.error) as e:
+                return 400, {"error": str(e)}
+        if method != "GET":
+            return 405, {"error": "GET only"}
+        if url.path == "/below":
+            try:
+                level = int(query.get("level", ["20"])[0])
+            except ValueError:
+                return 400, {"error": "level must be an integer"}
+            return 200, self.index.below(level)
+        if url.path == "/devices":
+            return 200, [self.index.view(key) for key in self.index.devices]
+        if url.path == "/health":
+            return 200, dict(self.index.summary(), batches=self.batches, records=self.records,
+                             uptime=round(time.time() - self.started))
+        return 404, {"error": "not found"}
+
+    def ingest(self, body, encoding) -> int:
+        if encoding == "deflate":
+            inflater = zlib.decompressobj()
+            body = inflater.decompress(body, MAX_INFLATED)
+            if inflater.unconsumed_tail:
+                raise ValueError("inflated body too large")
+        batch = json.loads(body)
+        agent = str(batch["agent"])
+        records = batch["records"]
+        for record in records:
+            self.index.update(agent, record)
+        self.batches += 1
+        self.records += len(records)
+        return len(records)
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle, host, port, backlog=1024)
+
+async def run(host, port):
+    aggregator = Aggregator()
+    server = await aggregator.serve(host, port)
+    print(f"Aggregating on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Collects battery telemetry from SteelDevice agents")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()